@@ -0,0 +1,52 @@
+#include <esim.h>
+
+#include <chrono>
+#include <iostream>
+#include <random>
+
+// Compares the per-pixel log transform with the lookup table on random 8 bit images.
+// Build with -DBUILD_BENCHMARK=ON, run ./benchmark_log_lut [width height repeats]
+
+double best_of(int repeats, const std::function<void()>& fn)
+{
+    double best = 1e9;
+    for (int i = 0; i < repeats; i++)
+    {
+        auto start = std::chrono::steady_clock::now();
+        fn();
+        best = std::min(best, std::chrono::duration<double, std::milli>(std::chrono::steady_clock::now() - start).count());
+    }
+    return best;
+}
+
+int main(int argc, char** argv)
+{
+    const int width = argc > 1 ? std::stoi(argv[1]) : 1280;
+    const int height = argc > 2 ? std::stoi(argv[2]) : 720;
+    const int repeats = argc > 3 ? std::stoi(argv[3]) : 20;
+    const float log_eps = 1e-3;
+
+    std::mt19937 rng(0);
+    cv::Mat img(height, width, CV_8U);
+    for (int y = 0; y < height; y++)
+        for (int x = 0; x < width; x++)
+            img.at<uchar>(y, x) = static_cast<uchar>(rng() % 256);
+
+    const cv::Mat lut = logLookupTable(log_eps, true);
+    cv::Mat log_img_per_pixel, log_img_lut;
+
+    const double ms_per_pixel = best_of(repeats, [&]() { log_img_per_pixel = logImage(img, log_eps, true); });
+    const double ms_lut = best_of(repeats, [&]() { cv::LUT(img, lut, log_img_lut); });
+
+    bool identical = true;
+    for (int y = 0; y < height; y++)
+        for (int x = 0; x < width; x++)
+            identical = identical && log_img_per_pixel.at<float>(y, x) == log_img_lut.at<float>(y, x);
+
+    std::cout << width << "x" << height << ", best of " << repeats << " runs" << std::endl;
+    std::cout << "convertTo + log: " << ms_per_pixel << " ms" << std::endl;
+    std::cout << "lookup table:    " << ms_lut << " ms" << std::endl;
+    std::cout << (identical ? "identical" : "NOT identical") << std::endl;
+
+    return identical ? 0 : 1;
+}
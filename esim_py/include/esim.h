@@ -1,9 +1,10 @@
 #pragma once
 
+#include <cstdint>
+#include <functional>
+#include <memory>
 #include <vector>
 
-#include <boost/filesystem.hpp>
-#include <Eigen/Core>
 #include <opencv2/core/core.hpp>
 
 
@@ -23,6 +24,93 @@ struct Event
   int polarity_;
 };
 
+/*
+ * Events stored column-wise with compact types, so that they can be handed to numpy
+ * without conversion. x and y are pixel coordinates, t is in seconds and p is +1 or -1.
+ */
+struct Events
+{
+  void append(const std::vector<Event>& events)
+  {
+    for (const Event& event : events)
+    {
+      x.push_back(static_cast<uint16_t>(event.x_));
+      y.push_back(static_cast<uint16_t>(event.y_));
+      t.push_back(event.t_);
+      p.push_back(static_cast<int8_t>(event.polarity_));
+    }
+  }
+
+  std::size_t size() const
+  {
+    return t.size();
+  }
+
+  // copies the events [begin, end)
+  Events slice(std::size_t begin, std::size_t end) const
+  {
+    Events events;
+    events.x.assign(x.begin() + begin, x.begin() + end);
+    events.y.assign(y.begin() + begin, y.begin() + end);
+    events.t.assign(t.begin() + begin, t.begin() + end);
+    events.p.assign(p.begin() + begin, p.begin() + end);
+    return events;
+  }
+
+  // removes the first n events
+  void eraseFront(std::size_t n)
+  {
+    x.erase(x.begin(), x.begin() + n);
+    y.erase(y.begin(), y.begin() + n);
+    t.erase(t.begin(), t.begin() + n);
+    p.erase(p.begin(), p.begin() + n);
+  }
+
+  std::vector<uint16_t> x, y;
+  std::vector<double> t;
+  std::vector<int8_t> p;
+};
+
+/*
+ * Decoded and log-transformed images of a sequence with their timestamps (in seconds), kept in memory
+ * so that the sequence can be simulated with many parameters without reading the images again.
+ * The images are preprocessed with the log_eps and use_log_img of the simulator that loaded them.
+ */
+struct FrameSequence
+{
+  std::size_t size() const
+  {
+    return images.size();
+  }
+
+  std::vector<cv::Mat> images;
+  std::vector<double> timestamps;
+  float log_eps;
+  bool use_log_img;
+};
+
+/*
+ * Preprocessing of the images: log(img/255 + log_eps) as float32, or img/255 if use_log_img is false.
+ * logImage computes it per pixel. logLookupTable holds its 256 values for 8 bit images (1 x 256, float32),
+ * computed by logImage, so that cv::LUT with the table gives the same values with one lookup per pixel.
+ */
+cv::Mat logImage(cv::Mat img, float log_eps, bool use_log_img);
+cv::Mat logLookupTable(float log_eps, bool use_log_img);
+
+/*
+ * Source of the images of a sequence, see the readers in esim.cpp.
+ */
+class FrameReader
+{
+public:
+  virtual ~FrameReader() {}
+
+  // reads the next image (8 bit, as decoded) and its timestamp in seconds, returns false at the end of the sequence
+  virtual bool read(cv::Mat& img, double& time) = 0;
+};
+
+class EventStream;
+
 /*
  * The EventSimulator takes as input a sequence of stamped images,
  * assumed to be sampled at a "sufficiently high" framerate,
@@ -42,9 +130,19 @@ public:
                  float log_eps,
                  bool use_log_img);
 
-  Eigen::MatrixXd generateFromFolder(std::string image_folder, std::string timestamps_file_path);
-  Eigen::MatrixXd generateFromVideo(std::string video_path, std::string timestamps_file_path);
-  Eigen::MatrixXd generateFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps);
+  Events generateFromFolder(std::string image_folder, std::string timestamps_file_path);
+  Events generateFromVideo(std::string video_path, std::string timestamps_file_path);
+  Events generateFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps);
+
+  FrameSequence loadFolder(std::string image_folder, std::string timestamps_file_path);
+  FrameSequence loadVideo(std::string video_path, std::string timestamps_file_path);
+  FrameSequence loadStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps);
+  Events generateFromFrames(const FrameSequence& frames);
+
+  // simulate while the events are consumed, see EventStream
+  EventStream streamFromFolder(std::string image_folder, std::string timestamps_file_path, std::size_t events_per_chunk);
+  EventStream streamFromVideo(std::string video_path, std::string timestamps_file_path, std::size_t events_per_chunk);
+  EventStream streamFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps, std::size_t events_per_chunk);
 
   void setParameters(float contrast_threshold_pos, 
                      float contrast_threshold_neg,
@@ -57,45 +155,29 @@ public:
     refractory_period_ = refractory_period;
     log_eps_ = log_eps;
     use_log_img_ = use_log_img;
+    log_lut_ = logLookupTable(log_eps, use_log_img);
   }
 
 private:
-      
-  Eigen::MatrixXd vec_to_eigen_matrix(std::vector<Event>& events_vec)
-  {
-    Eigen::MatrixXd events(events_vec.size(), 4);
-    for (int i=0; i<events_vec.size(); i++)
-    {
-        Event& event = events_vec[i]; 
-        events(i,0) = event.x_;
-        events(i,1) = event.y_;
-        events(i,2) = event.t_;
-        events(i,3) = event.polarity_;
-    }
-    return events;
-  }
 
-  void imageCallback(const cv::Mat& img, double time, std::vector<Event>& events);
-  void init(const cv::Mat &img, double time);  
-   
-  void read_directory_from_path(const std::string& name, std::vector<std::string>& v)
-  {
-      boost::filesystem::path p(name);
-      boost::filesystem::directory_iterator start(p);
-      boost::filesystem::directory_iterator end;
+  friend class EventStream;
 
-      auto path_leaf_string = [](const boost::filesystem::directory_entry& entry) -> std::string {return entry.path().string();};
+  typedef std::function<void(const cv::Mat&, double)> FrameCallback;
 
-      std::transform(start, end, std::back_inserter(v), path_leaf_string);
+  // read and preprocess the images of a sequence, calling callback with each image and its timestamp
+  void readFrames(FrameReader& reader, const FrameCallback& callback);
+  cv::Mat preprocess(cv::Mat img) const;
+  FrameSequence emptyFrameSequence() const;
 
-      std::sort(v.begin(), v.end());
-  }  
+  void imageCallback(const cv::Mat& img, double time, Events& events);
+  void init(const cv::Mat &img, double time);  
 
   float contrast_threshold_pos_; 
   float contrast_threshold_neg_;
   float refractory_period_;
   float log_eps_;
   bool use_log_img_;
+  cv::Mat log_lut_;
 
   bool is_initialized_;
   double current_time_;
@@ -105,3 +187,36 @@ private:
   int image_height_;
   int image_width_;
 };
+
+/*
+ * Events of a sequence in chunks, simulated when the next chunk is requested, so that memory stays bounded
+ * for long sequences. The stream has its own copy of the simulator, whose state carries over from chunk to chunk.
+ * With events_per_chunk = 0 every chunk holds the events of one frame (the first frame only initializes the
+ * simulator), otherwise every chunk holds events_per_chunk events, except for the last one.
+ */
+class EventStream
+{
+public:
+  EventStream(const EventSimulator& simulator, std::unique_ptr<FrameReader> reader, std::size_t events_per_chunk);
+
+  // stores the next chunk in chunk, returns false at the end of the sequence
+  bool next(Events& chunk);
+
+private:
+  EventSimulator simulator_;
+  std::unique_ptr<FrameReader> reader_;
+  std::size_t events_per_chunk_;
+  // events simulated but not returned yet are pending_[pending_begin_:]
+  Events pending_;
+  std::size_t pending_begin_ = 0;
+};
+
+/*
+ * Simulates the frames once for every configuration (contrast_thresholds_pos[i], contrast_thresholds_neg[i],
+ * refractory_periods[i]), on num_threads threads (<= 0: one per core). Returns the events of each configuration.
+ */
+std::vector<Events> generateSweep(const FrameSequence& frames,
+                                  const std::vector<float>& contrast_thresholds_pos,
+                                  const std::vector<float>& contrast_thresholds_neg,
+                                  const std::vector<float>& refractory_periods,
+                                  int num_threads);
@@ -1,19 +1,119 @@
 #include <esim.h>
 
-#include <pybind11/eigen.h>
+#include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 
+#include <utility>
+
 
 namespace py = pybind11;
 
+// numpy array viewing the data of vec, which is moved to the heap and freed together with the array
+template <typename T>
+py::array_t<T> to_numpy(std::vector<T>&& vec)
+{
+    auto* data = new std::vector<T>(std::move(vec));
+    py::capsule owner(data, [](void* ptr) { delete reinterpret_cast<std::vector<T>*>(ptr); });
+    return py::array_t<T>(data->size(), data->data(), owner);
+}
+
+// dict with the arrays x, y (uint16), t (float64, seconds) and p (int8, +1/-1), as returned by esim_torch
+py::dict to_dict(Events&& events)
+{
+    py::dict out;
+    out["x"] = to_numpy(std::move(events.x));
+    out["y"] = to_numpy(std::move(events.y));
+    out["t"] = to_numpy(std::move(events.t));
+    out["p"] = to_numpy(std::move(events.p));
+    return out;
+}
+
 PYBIND11_MODULE(esim_py, m) {
     m.doc() = "ESIM bindings";
 
+    py::class_<FrameSequence>(m, "FrameSequence")
+        .def("__len__", &FrameSequence::size)
+        .def_readonly("timestamps", &FrameSequence::timestamps)
+        .def_readonly("log_eps", &FrameSequence::log_eps)
+        .def_readonly("use_log_img", &FrameSequence::use_log_img);
+
+    py::class_<EventStream>(m, "EventStream")
+        .def("__iter__", [](EventStream& self) -> EventStream& { return self; })
+        .def("__next__", [](EventStream& self)
+        {
+            Events chunk;
+            bool has_chunk;
+            {
+                py::gil_scoped_release release;
+                has_chunk = self.next(chunk);
+            }
+            if (!has_chunk)
+                throw py::stop_iteration();
+            return to_dict(std::move(chunk));
+        });
+
     py::class_<EventSimulator>(m, "EventSimulator")
         .def(py::init<float,float,float,float,bool>())
-        .def("generateFromFolder", &EventSimulator::generateFromFolder, py::return_value_policy::reference_internal)
-        .def("generateFromVideo", &EventSimulator::generateFromVideo, py::return_value_policy::reference_internal)
-        .def("generateFromStampedImageSequence", &EventSimulator::generateFromStampedImageSequence, py::return_value_policy::reference_internal)
+        .def("generateFromFolder", [](EventSimulator& self, std::string image_folder, std::string timestamps_file_path)
+        {
+            Events events;
+            {
+                py::gil_scoped_release release;
+                events = self.generateFromFolder(image_folder, timestamps_file_path);
+            }
+            return to_dict(std::move(events));
+        })
+        .def("generateFromVideo", [](EventSimulator& self, std::string video_path, std::string timestamps_file_path)
+        {
+            Events events;
+            {
+                py::gil_scoped_release release;
+                events = self.generateFromVideo(video_path, timestamps_file_path);
+            }
+            return to_dict(std::move(events));
+        })
+        .def("generateFromStampedImageSequence", [](EventSimulator& self, std::vector<std::string> image_paths, std::vector<double> timestamps)
+        {
+            Events events;
+            {
+                py::gil_scoped_release release;
+                events = self.generateFromStampedImageSequence(image_paths, timestamps);
+            }
+            return to_dict(std::move(events));
+        })
+        .def("loadFolder", &EventSimulator::loadFolder, py::call_guard<py::gil_scoped_release>())
+        .def("loadVideo", &EventSimulator::loadVideo, py::call_guard<py::gil_scoped_release>())
+        .def("loadStampedImageSequence", &EventSimulator::loadStampedImageSequence, py::call_guard<py::gil_scoped_release>())
+        .def("generateFromFrames", [](EventSimulator& self, const FrameSequence& frames)
+        {
+            Events events;
+            {
+                py::gil_scoped_release release;
+                events = self.generateFromFrames(frames);
+            }
+            return to_dict(std::move(events));
+        })
+        .def("streamFromFolder", &EventSimulator::streamFromFolder, 
+             py::arg("image_folder"), py::arg("timestamps_file_path"), py::arg("events_per_chunk") = 0)
+        .def("streamFromVideo", &EventSimulator::streamFromVideo, 
+             py::arg("video_path"), py::arg("timestamps_file_path"), py::arg("events_per_chunk") = 0)
+        .def("streamFromStampedImageSequence", &EventSimulator::streamFromStampedImageSequence, 
+             py::arg("image_paths"), py::arg("timestamps"), py::arg("events_per_chunk") = 0)
         .def("setParameters", &EventSimulator::setParameters);
-}
\ No newline at end of file
+
+    m.def("generateSweep", [](const FrameSequence& frames, std::vector<float> contrast_thresholds_pos, 
+                              std::vector<float> contrast_thresholds_neg, std::vector<float> refractory_periods, int num_threads)
+    {
+        std::vector<Events> results;
+        {
+            py::gil_scoped_release release;
+            results = generateSweep(frames, contrast_thresholds_pos, contrast_thresholds_neg, refractory_periods, num_threads);
+        }
+        py::list out;
+        for (Events& events : results)
+            out.append(to_dict(std::move(events)));
+        return out;
+    }, py::arg("frames"), py::arg("contrast_thresholds_pos"), py::arg("contrast_thresholds_neg"), py::arg("refractory_periods"), 
+       py::arg("num_threads") = 0);
+}
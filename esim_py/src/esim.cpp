@@ -3,8 +3,12 @@
 #include <fstream>
 #include <iostream>
 #include <algorithm>
+#include <atomic>
+#include <exception>
+#include <thread>
 
-#include <opencv2/core/eigen.hpp>
+#include <boost/filesystem.hpp>
+#include <opencv2/core/utility.hpp>
 #include <opencv2/highgui/highgui.hpp>
 #include <opencv2/imgproc/imgproc.hpp>
 
@@ -15,141 +19,387 @@ EventSimulator::EventSimulator(float contrast_threshold_pos,
                                float log_eps,
                                bool use_log_img)
     : contrast_threshold_pos_(contrast_threshold_pos), contrast_threshold_neg_(contrast_threshold_neg),
-    refractory_period_(refractory_period), log_eps_(log_eps), use_log_img_(use_log_img), is_initialized_(false)
+    refractory_period_(refractory_period), log_eps_(log_eps), use_log_img_(use_log_img),
+    log_lut_(logLookupTable(log_eps, use_log_img)), is_initialized_(false)
 {
 
 }
 
-Eigen::MatrixXd EventSimulator::generateFromVideo(std::string video_path, std::string timestamps_file_path)
+cv::Mat logImage(cv::Mat img, float log_eps, bool use_log_img)
 {
-    std::ifstream timestamps_file(timestamps_file_path);
-    
-    if(!timestamps_file.is_open()) 
-        throw std::runtime_error("unable to open the file " + timestamps_file_path);
+    img.convertTo(img, CV_32F, 1.0/255);
+    if (use_log_img)
+        cv::log(img+log_eps, img);
+    return img;
+}
+
+cv::Mat logLookupTable(float log_eps, bool use_log_img)
+{
+    cv::Mat intensities(1, 256, CV_8U);
+    for (int i = 0; i < 256; i++)
+        intensities.at<uchar>(0, i) = static_cast<uchar>(i);
+    return logImage(intensities, log_eps, use_log_img);
+}
 
-    cv::VideoCapture cap(video_path);
+namespace
+{
 
-    if ( !cap.isOpened() ) 
-        throw std::runtime_error("Cannot open the video file " + video_path);
+class VideoReader : public FrameReader
+{
+public:
+    VideoReader(const std::string& video_path, const std::string& timestamps_file_path)
+        : timestamps_file_(timestamps_file_path), cap_(video_path)
+    {
+        if(!timestamps_file_.is_open()) 
+            throw std::runtime_error("unable to open the file " + timestamps_file_path);
 
-    std::string time_str;
-    double time;
+        if ( !cap_.isOpened() ) 
+            throw std::runtime_error("Cannot open the video file " + video_path);
+    }
+
+    bool read(cv::Mat& img, double& time) override
+    {
+        if (!cap_.read(img))
+            return false;
+
+        std::string time_str;
+        std::getline(timestamps_file_, time_str);
+        time = std::stod(time_str);
+        return true;
+    }
+
+private:
+    std::ifstream timestamps_file_;
+    cv::VideoCapture cap_;
+};
+
+class StampedImageSequenceReader : public FrameReader
+{
+public:
+    StampedImageSequenceReader(const std::vector<std::string>& image_paths, const std::vector<double>& timestamps)
+        : image_paths_(image_paths), timestamps_(timestamps), index_(0)
+    {
+        // check that timestamps are ascending
+        if (image_paths.size() != timestamps.size())
+            throw std::runtime_error("Number of image paths and number of timestamps should be equal. Got " + std::to_string(image_paths.size()) + " and " + std::to_string(timestamps.size()));
+    }
+
+    bool read(cv::Mat& img, double& time) override
+    {
+        if (index_ >= timestamps_.size())
+            return false;
+
+        if ((index_ < timestamps_.size()-1)  && timestamps_[index_+1]<timestamps_[index_]) 
+            throw std::runtime_error("Timestamps must be sorted in ascending order.");
+
+        img = cv::imread(image_paths_[index_], cv::IMREAD_GRAYSCALE);
+
+        if(img.empty()) 
+            throw std::runtime_error("unable to open the image " + image_paths_[index_]);
+
+        time = timestamps_[index_];
+        index_++;
+        return true;
+    }
+
+private:
+    std::vector<std::string> image_paths_;
+    std::vector<double> timestamps_;
+    std::size_t index_;
+};
+
+class FolderReader : public FrameReader
+{
+public:
+    FolderReader(const std::string& image_folder, const std::string& timestamps_file_path)
+        : timestamps_file_(timestamps_file_path), index_(0)
+    {
+        read_directory_from_path(image_folder, image_files_);
 
-    std::vector<Event> events_vec;
-    
-    cv::Mat img, log_img;
+        if(!timestamps_file_.is_open()) 
+            throw std::runtime_error("unable to open the file " + timestamps_file_path);
+    }
 
-    while (cap.read(img))
+    bool read(cv::Mat& img, double& time) override
     {
-        img.convertTo(img, CV_32F, 1.0/255);
-        cv::Mat log_img = img;
-        if (use_log_img_)
-            cv::log(img+log_eps_, log_img);
-        
-        std::getline(timestamps_file, time_str);
+        if (index_ >= image_files_.size())
+            return false;
+
+        const std::string& file = image_files_[index_++];
+        img = cv::imread(file, cv::IMREAD_GRAYSCALE);
+        if(img.empty()) 
+            throw std::runtime_error("unable to open the image " + file);
+
+        std::string time_str;
+        std::getline(timestamps_file_, time_str);
         time = std::stod(time_str);
-        
-        imageCallback(log_img, time, events_vec);
+        return true;
     }
 
+private:
+    static void read_directory_from_path(const std::string& name, std::vector<std::string>& v)
+    {
+        boost::filesystem::path p(name);
+        boost::filesystem::directory_iterator start(p);
+        boost::filesystem::directory_iterator end;
+
+        auto path_leaf_string = [](const boost::filesystem::directory_entry& entry) -> std::string {return entry.path().string();};
+
+        std::transform(start, end, std::back_inserter(v), path_leaf_string);
+
+        std::sort(v.begin(), v.end());
+    }  
+
+    std::vector<std::string> image_files_;
+    std::ifstream timestamps_file_;
+    std::size_t index_;
+};
+
+} // namespace
+
+void EventSimulator::readFrames(FrameReader& reader, const FrameCallback& callback)
+{
+    cv::Mat img;
+    double time;
+
+    while (reader.read(img, time))
+        callback(preprocess(img), time);
+}
+
+cv::Mat EventSimulator::preprocess(cv::Mat img) const
+{
+    if (img.depth() != CV_8U)
+        return logImage(img, log_eps_, use_log_img_);
+
+    // 8 bit images take one table lookup per pixel instead of a conversion, an addition and a logarithm
+    cv::Mat log_img;
+    cv::LUT(img, log_lut_, log_img);
+    return log_img;
+}
+
+Events EventSimulator::generateFromVideo(std::string video_path, std::string timestamps_file_path)
+{
+    Events events;
+    VideoReader reader(video_path, timestamps_file_path);
+    readFrames(reader, [&](const cv::Mat& log_img, double time) { imageCallback(log_img, time, events); });
+
     // reset state to generate new events
     is_initialized_ = false;
 
-    return vec_to_eigen_matrix(events_vec);
+    return events;
 }
 
-Eigen::MatrixXd EventSimulator::generateFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps)
+Events EventSimulator::generateFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps)
 {
-    // check that timestamps are ascending
-    if (image_paths.size() != timestamps.size())
-        throw std::runtime_error("Number of image paths and number of timestamps should be equal. Got " + std::to_string(image_paths.size()) + " and " + std::to_string(timestamps.size()));
+    Events events;
+    StampedImageSequenceReader reader(image_paths, timestamps);
+    readFrames(reader, [&](const cv::Mat& log_img, double time) { imageCallback(log_img, time, events); });
 
-    cv::Mat img, log_img;
-    double time;
+    // reset state to generate new events
+    is_initialized_ = false;
+
+    return events;
+}
+
+Events EventSimulator::generateFromFolder(std::string image_folder, std::string timestamps_file_path)
+{
+    Events events;
+    FolderReader reader(image_folder, timestamps_file_path);
+    readFrames(reader, [&](const cv::Mat& log_img, double time) { imageCallback(log_img, time, events); });
+
+    // reset state to generate new events
+    is_initialized_ = false;
 
-    std::vector<Event> events_vec;
+    return events;
+}
+
+FrameSequence EventSimulator::emptyFrameSequence() const
+{
+    FrameSequence frames;
+    frames.log_eps = log_eps_;
+    frames.use_log_img = use_log_img_;
+    return frames;
+}
 
-    for (int i=0; i<timestamps.size(); i++)
+FrameSequence EventSimulator::loadVideo(std::string video_path, std::string timestamps_file_path)
+{
+    FrameSequence frames = emptyFrameSequence();
+    VideoReader reader(video_path, timestamps_file_path);
+    readFrames(reader, [&](const cv::Mat& log_img, double time)
     {
-        if ((i < timestamps.size()-1)  && timestamps[i+1]<timestamps[i]) 
-            throw std::runtime_error("Timestamps must be sorted in ascending order.");
+        frames.images.push_back(log_img);
+        frames.timestamps.push_back(time);
+    });
+    return frames;
+}
 
-        img = cv::imread(image_paths[i], cv::IMREAD_GRAYSCALE);
+FrameSequence EventSimulator::loadStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps)
+{
+    FrameSequence frames = emptyFrameSequence();
+    StampedImageSequenceReader reader(image_paths, timestamps);
+    readFrames(reader, [&](const cv::Mat& log_img, double time)
+    {
+        frames.images.push_back(log_img);
+        frames.timestamps.push_back(time);
+    });
+    return frames;
+}
 
-        if(img.empty()) 
-            throw std::runtime_error("unable to open the image " + image_paths[i]);
-       
-        img.convertTo(img, CV_32F, 1.0/255);
-        cv::Mat log_img = img;
-        if (use_log_img_)
-            cv::log(img+log_eps_, log_img);
+FrameSequence EventSimulator::loadFolder(std::string image_folder, std::string timestamps_file_path)
+{
+    FrameSequence frames = emptyFrameSequence();
+    FolderReader reader(image_folder, timestamps_file_path);
+    readFrames(reader, [&](const cv::Mat& log_img, double time)
+    {
+        frames.images.push_back(log_img);
+        frames.timestamps.push_back(time);
+    });
+    return frames;
+}
 
-        time = timestamps[i];
+Events EventSimulator::generateFromFrames(const FrameSequence& frames)
+{
+    Events events;
 
-        imageCallback(log_img, time, events_vec);
-    }
+    for (std::size_t i=0; i<frames.size(); i++)
+        imageCallback(frames.images[i], frames.timestamps[i], events);
 
     // reset state to generate new events
     is_initialized_ = false;
 
-    return vec_to_eigen_matrix(events_vec);
+    return events;
 }
 
+EventStream EventSimulator::streamFromVideo(std::string video_path, std::string timestamps_file_path, std::size_t events_per_chunk)
+{
+    return EventStream(*this, std::unique_ptr<FrameReader>(new VideoReader(video_path, timestamps_file_path)), events_per_chunk);
+}
 
-Eigen::MatrixXd EventSimulator::generateFromFolder(std::string image_folder, std::string timestamps_file_path)
+EventStream EventSimulator::streamFromStampedImageSequence(std::vector<std::string> image_paths, std::vector<double> timestamps, std::size_t events_per_chunk)
 {
-    std::vector<std::string> image_files;
-    read_directory_from_path(image_folder, image_files);
-    std::ifstream timestamps_file(timestamps_file_path);
-    
-    if(!timestamps_file.is_open()) 
-        throw std::runtime_error("unable to open the file " + timestamps_file_path);
+    return EventStream(*this, std::unique_ptr<FrameReader>(new StampedImageSequenceReader(image_paths, timestamps)), events_per_chunk);
+}
 
-    std::string time_str;
+EventStream EventSimulator::streamFromFolder(std::string image_folder, std::string timestamps_file_path, std::size_t events_per_chunk)
+{
+    return EventStream(*this, std::unique_ptr<FrameReader>(new FolderReader(image_folder, timestamps_file_path)), events_per_chunk);
+}
+
+EventStream::EventStream(const EventSimulator& simulator, std::unique_ptr<FrameReader> reader, std::size_t events_per_chunk)
+    : simulator_(simulator), reader_(std::move(reader)), events_per_chunk_(events_per_chunk)
+{
+    // the stream starts a new sequence, whatever the state of simulator. The copy shares the image buffers
+    // of simulator, detach them so that neither overwrites the state of the other
+    simulator_.is_initialized_ = false;
+    simulator_.last_img_.release();
+    simulator_.ref_values_.release();
+    simulator_.last_event_timestamp_.release();
+}
+
+bool EventStream::next(Events& chunk)
+{
+    cv::Mat img;
     double time;
 
-    std::vector<Event> events_vec;
-    
-    cv::Mat img, log_img;
+    if (events_per_chunk_ == 0)
+    {
+        while (reader_->read(img, time))
+        {
+            const bool first_frame = !simulator_.is_initialized_;
+            simulator_.imageCallback(simulator_.preprocess(img), time, chunk);
+            if (!first_frame)
+                return true;
+        }
+        return false;
+    }
 
-    for (const std::string& file : image_files)
+    // events of a frame beyond the current chunk are kept for the next one. The returned events are only
+    // dropped from pending_ before it is refilled, which moves fewer than events_per_chunk_ events
+    if (pending_.size() - pending_begin_ < events_per_chunk_)
     {
-        img = cv::imread(file, cv::IMREAD_GRAYSCALE);
-        if(img.empty()) 
-            throw std::runtime_error("unable to open the image " + file);
+        pending_.eraseFront(pending_begin_);
+        pending_begin_ = 0;
+        while (pending_.size() < events_per_chunk_ && reader_->read(img, time))
+            simulator_.imageCallback(simulator_.preprocess(img), time, pending_);
+    }
 
-        img.convertTo(img, CV_32F, 1.0/255);
-        cv::Mat log_img = img;
-        if (use_log_img_)
-            cv::log(img+log_eps_, log_img);
+    if (pending_begin_ == pending_.size())
+        return false;
 
-        std::getline(timestamps_file, time_str);
-        time = std::stod(time_str);
+    const std::size_t end = std::min(pending_begin_ + events_per_chunk_, pending_.size());
+    chunk = pending_.slice(pending_begin_, end);
+    pending_begin_ = end;
+    return true;
+}
 
-        imageCallback(log_img, time, events_vec);
-    }
+std::vector<Events> generateSweep(const FrameSequence& frames,
+                                  const std::vector<float>& contrast_thresholds_pos,
+                                  const std::vector<float>& contrast_thresholds_neg,
+                                  const std::vector<float>& refractory_periods,
+                                  int num_threads)
+{
+    const std::size_t num_configs = contrast_thresholds_pos.size();
+    if (contrast_thresholds_neg.size() != num_configs || refractory_periods.size() != num_configs)
+        throw std::runtime_error("Expected one negative contrast threshold and refractory period per positive contrast threshold. Got " 
+            + std::to_string(num_configs) + ", " + std::to_string(contrast_thresholds_neg.size()) + " and " + std::to_string(refractory_periods.size()));
 
-    // reset state to generate new events
-    is_initialized_ = false;
+    if (num_threads <= 0)
+        num_threads = std::max(1u, std::thread::hardware_concurrency());
+    num_threads = std::min<std::size_t>(num_threads, std::max<std::size_t>(num_configs, 1));
 
-    return vec_to_eigen_matrix(events_vec);
+    // the frames are only read, every thread simulates whole configurations with its own simulator
+    std::vector<Events> results(num_configs);
+    std::atomic<std::size_t> next_config(0);
+    std::vector<std::exception_ptr> errors(num_threads);
+
+    auto worker = [&](int thread_id)
+    {
+        try
+        {
+            for (std::size_t i = next_config++; i < num_configs; i = next_config++)
+            {
+                EventSimulator simulator(contrast_thresholds_pos[i], contrast_thresholds_neg[i], refractory_periods[i], 
+                                         frames.log_eps, frames.use_log_img);
+                results[i] = simulator.generateFromFrames(frames);
+            }
+        }
+        catch (...)
+        {
+            errors[thread_id] = std::current_exception();
+        }
+    };
+
+    std::vector<std::thread> threads;
+    for (int thread_id = 0; thread_id < num_threads; thread_id++)
+        threads.emplace_back(worker, thread_id);
+    for (std::thread& thread : threads)
+        thread.join();
+
+    for (const std::exception_ptr& error : errors)
+        if (error)
+            std::rethrow_exception(error);
+
+    return results;
 }
 
 
 void EventSimulator::init(const cv::Mat &img, double time)
 {
   is_initialized_ = true;
-  last_img_ = img;
-  ref_values_ = img;
+  // ref_values_ shares its data with last_img_ until the next image arrives, but not with img,
+  // so that the images of a FrameSequence stay unchanged
+  last_img_ = img.clone();
+  ref_values_ = last_img_;
 
-  last_event_timestamp_ = cv::Mat::zeros(img.size[0], img.size[1], CV_64F);
+  // a new buffer rather than zeroing the old one in place, which copies of this simulator may still use
+  last_event_timestamp_ = cv::Mat(img.size[0], img.size[1], CV_64F, cv::Scalar(0));
 
   current_time_ = time;
   image_width_ = img.size[1];
   image_height_ = img.size[0];
 }
 
-void EventSimulator::imageCallback(const cv::Mat& img, double time, std::vector<Event>& events)
+void EventSimulator::imageCallback(const cv::Mat& img, double time, Events& events)
 {
     cv::Mat preprocessed_img = img;
   
@@ -159,62 +409,91 @@ void EventSimulator::imageCallback(const cv::Mat& img, double time, std::vector<
         return;
     }
 
-    std::vector<Event> new_events;
-
     static constexpr double kTolerance = 1e-6;
-    double delta_t = time - current_time_;
+    const double delta_t = time - current_time_;
 
-    for (int y = 0; y < image_height_; ++y)
+    // The rows are split into tiles which are simulated in parallel, each tile collects its events in its own buffer.
+    // Concatenating the buffers in tile order gives the row-major order of the serial loop, so the sorted output
+    // is identical for any number of threads.
+    const int num_tiles = std::max(1, std::min(image_height_, 4 * cv::getNumThreads()));
+    std::vector<std::vector<Event>> tile_events(num_tiles);
+
+    cv::parallel_for_(cv::Range(0, num_tiles), [&](const cv::Range& tiles)
     {
-        for (int x = 0; x < image_width_; ++x)
+        for (int tile = tiles.start; tile < tiles.end; ++tile)
         {
-            float& itdt = preprocessed_img.at<float>(y, x);
-            float& it = last_img_.at<float>(y, x);
-            float& prev_cross = ref_values_.at<float>(y, x);
+            std::vector<Event>& new_events = tile_events[tile];
+            const int y_start = tile * image_height_ / num_tiles;
+            const int y_end = (tile + 1) * image_height_ / num_tiles;
 
-            if (std::fabs (it - itdt) > kTolerance)
+            for (int y = y_start; y < y_end; ++y)
             {
-                float pol = (itdt >= it) ? +1.0 : -1.0;
-                float C = (pol > 0) ? contrast_threshold_pos_ : contrast_threshold_neg_;
-                
-                float curr_cross = prev_cross;
-                bool all_crossings = false;
-      
-                do
+                // on the first frame last_img_ and ref_values_ share their data, so these are not restrict
+                const float* itdt_row = preprocessed_img.ptr<float>(y);
+                float* it_row = last_img_.ptr<float>(y);
+                float* prev_cross_row = ref_values_.ptr<float>(y);
+                double* last_stamp_row = last_event_timestamp_.ptr<double>(y);
+
+                for (int x = 0; x < image_width_; ++x)
                 {
-                    curr_cross += pol * C;
-      
-                    if ((pol > 0 && curr_cross > it && curr_cross <= itdt)
-                        || (pol < 0 && curr_cross < it && curr_cross >= itdt))
+                    const float& itdt = itdt_row[x];
+                    float& it = it_row[x];
+                    float& prev_cross = prev_cross_row[x];
+
+                    if (std::fabs (it - itdt) > kTolerance)
                     {
-                        const double edt = (curr_cross - it) * delta_t / (itdt - it);
-                        const double t = current_time_ + edt;
-      
-                        const double last_stamp_at_xy = last_event_timestamp_.at<double>(y,x);
-                        
-                        const double dt = t - last_stamp_at_xy;
-
-                        if(last_stamp_at_xy == 0 || dt >= refractory_period_)
+                        float pol = (itdt >= it) ? +1.0 : -1.0;
+                        float C = (pol > 0) ? contrast_threshold_pos_ : contrast_threshold_neg_;
+
+                        float curr_cross = prev_cross;
+                        bool all_crossings = false;
+
+                        do
                         {
-                            new_events.emplace_back(x, y,t,pol);
-                            last_event_timestamp_.at<double>(y,x) = t;
-                        }
-                     
-                        ref_values_.at<float>(y,x) = curr_cross;
-                    }
-                    else
-                    {
-                        all_crossings = true;
-                    }
-                } while (!all_crossings);
-            } // end tolerance
-        } // end for each pixel
-    }
+                            curr_cross += pol * C;
+
+                            if ((pol > 0 && curr_cross > it && curr_cross <= itdt)
+                                || (pol < 0 && curr_cross < it && curr_cross >= itdt))
+                            {
+                                const double edt = (curr_cross - it) * delta_t / (itdt - it);
+                                const double t = current_time_ + edt;
+
+                                const double last_stamp_at_xy = last_stamp_row[x];
+
+                                const double dt = t - last_stamp_at_xy;
+
+                                if(last_stamp_at_xy == 0 || dt >= refractory_period_)
+                                {
+                                    new_events.emplace_back(x, y,t,pol);
+                                    last_stamp_row[x] = t;
+                                }
+
+                                prev_cross_row[x] = curr_cross;
+                            }
+                            else
+                            {
+                                all_crossings = true;
+                            }
+                        } while (!all_crossings);
+                    } // end tolerance
+                } // end for each pixel
+            }
+        }
+    });
+
+    std::size_t num_new_events = 0;
+    for (const std::vector<Event>& buffer : tile_events)
+        num_new_events += buffer.size();
+
+    std::vector<Event> new_events;
+    new_events.reserve(num_new_events);
+    for (const std::vector<Event>& buffer : tile_events)
+        new_events.insert(new_events.end(), buffer.begin(), buffer.end());
 
     current_time_ = time;
     last_img_ = preprocessed_img; // it is now the latest image
 
     // need to sort the new events before inserting
     std::sort(new_events.begin(), new_events.end());
-    events.insert(events.end(), new_events.begin(), new_events.end());
+    events.append(new_events);
 }
@@ -18,14 +18,14 @@ from os.path import join
 
 
 def viz_events(events, resolution):
-    pos_events = events[events[:,-1]==1]
-    neg_events = events[events[:,-1]==-1]
+    pos = events["p"] == 1
+    neg = events["p"] == -1
 
     image_pos = np.zeros(resolution[0]*resolution[1], dtype="uint8")
     image_neg = np.zeros(resolution[0]*resolution[1], dtype="uint8")
 
-    np.add.at(image_pos, (pos_events[:,0]+pos_events[:,1]*resolution[1]).astype("int32"), pos_events[:,-1]**2)
-    np.add.at(image_neg, (neg_events[:,0]+neg_events[:,1]*resolution[1]).astype("int32"), neg_events[:,-1]**2)
+    np.add.at(image_pos, events["x"][pos].astype("int32")+events["y"][pos].astype("int32")*resolution[1], 1)
+    np.add.at(image_neg, events["x"][neg].astype("int32")+events["y"][neg].astype("int32")*resolution[1], 1)
 
     image_rgb = np.stack(
         [
@@ -62,15 +62,20 @@ refractory_periods = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
 
 num_events_plot = 30000
 
-for i, Cp in enumerate(contrast_thresholds_pos):
-    for j, Cn in enumerate(contrast_thresholds_neg):
-        esim.setParameters(Cp, Cn, refractory_period, log_eps, use_log)
-        events = esim.generateFromFolder(image_folder, timestamps_file)
-        
-        image_rgb = viz_events(events[:num_events_plot], [H, W])
-
-        ax[i,j].imshow(image_rgb)
-        ax[i,j].axis('off')
-        ax[i,j].set_title("Cp=%s Cn=%s" % (Cp, Cn))
+# the images are decoded and log-transformed once, the 25 threshold combinations are simulated in parallel
+frames = esim.loadFolder(image_folder, timestamps_file)
+configs = [(Cp, Cn) for Cp in contrast_thresholds_pos for Cn in contrast_thresholds_neg]
+sweep = esim_py.generateSweep(frames, 
+                              [Cp for Cp, _ in configs], 
+                              [Cn for _, Cn in configs], 
+                              [refractory_period] * len(configs))
+
+for k, ((Cp, Cn), events) in enumerate(zip(configs, sweep)):
+    i, j = divmod(k, len(contrast_thresholds_neg))
+    image_rgb = viz_events({key: v[:num_events_plot] for key, v in events.items()}, [H, W])
+
+    ax[i,j].imshow(image_rgb)
+    ax[i,j].axis('off')
+    ax[i,j].set_title("Cp=%s Cn=%s" % (Cp, Cn))
 
 plt.show()
@@ -0,0 +1,52 @@
+import os
+import argparse
+import numpy as np
+try:
+    import esim_py
+except ImportError:
+    print("esim_py not found, importing binaries. These do not correspond to source files in this repo")
+    import sys
+    binaries_folder = os.path.join(os.path.dirname(__file__), "..", "bin")
+    sys.path.append(binaries_folder)
+    import esim_py
+
+
+def concatenate(chunks):
+    return {k: np.concatenate([chunk[k] for chunk in chunks]) for k in "xytp"}
+
+
+def assert_equal(events, reference, message):
+    for k in "xytp":
+        assert np.array_equal(events[k], reference[k]), "Mismatch in {}: {}".format(k, message)
+
+
+if __name__ == "__main__":
+    data_folder = os.path.join(os.path.dirname(__file__), "data", "images")
+    parser = argparse.ArgumentParser("Checks that streams and full simulations of one simulator do not share state.")
+    parser.add_argument("--image_folder", default=os.path.join(data_folder, "images"))
+    parser.add_argument("--timestamps_file", default=os.path.join(data_folder, "timestamps.txt"))
+    parser.add_argument("--events_per_chunk", type=int, default=5000)
+    args = parser.parse_args()
+
+    # a refractory period so that the simulation depends on the timestamps of the last events
+    esim = esim_py.EventSimulator(0.2, 0.2, 1e-3, 1e-3, True)
+    reference = esim.generateFromFolder(args.image_folder, args.timestamps_file)
+    print("Num events: {}".format(len(reference["t"])))
+
+    for events_per_chunk in [0, args.events_per_chunk]:
+        print("Interleaving two streams with {} events per chunk and full simulations".format(events_per_chunk))
+        # esim is initialized at this point, the streams must not share its state or each other's
+        streams = [esim.streamFromFolder(args.image_folder, args.timestamps_file, events_per_chunk) for _ in range(2)]
+        chunks = [[], []]
+        for i, (chunk_0, chunk_1) in enumerate(zip(*streams)):
+            chunks[0].append(chunk_0)
+            chunks[1].append(chunk_1)
+            if i < 3:
+                assert_equal(esim.generateFromFolder(args.image_folder, args.timestamps_file), reference,
+                             "generateFromFolder while streaming")
+        for stream, stream_chunks in zip(streams, chunks):
+            stream_chunks.extend(stream)
+
+        for stream_chunks in chunks:
+            assert_equal(concatenate(stream_chunks), reference, "stream")
+        print("Streams and full simulations are identical")
@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+import esim_torch
+
+
+def to_log_image_float(image, log_eps):
+    # per-pixel log transform, as scripts/generate_events.py did before the lookup table
+    return np.log(image.astype("float32") / 255 + log_eps)
+
+
+def timeit(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t_start)
+    return best
+
+
+def bench_transform(args):
+    rng = np.random.default_rng(0)
+    print("log transform of 8 bit images, best of {} runs".format(args.repeats))
+    print("{:>12}{:>12}{:>12}".format("size", "float [ms]", "lut [ms]"))
+    for w, h in args.sizes:
+        image = rng.integers(0, 256, (h, w), dtype=np.uint8)
+        assert np.array_equal(to_log_image_float(image, args.log_eps), esim_torch.to_log_image(image, args.log_eps)), \
+            "log images disagree"
+        t_float = timeit(lambda: to_log_image_float(image, args.log_eps), args.repeats)
+        t_lut = timeit(lambda: esim_torch.to_log_image(image, args.log_eps), args.repeats)
+        print("{:>12}{:>12.2f}{:>12.2f}".format("{}x{}".format(w, h), 1e3 * t_float, 1e3 * t_lut))
+
+
+def bench_load(args):
+    # decoding included, on the images of a sequence
+    image_files = sorted(glob.glob(os.path.join(args.images, "*.png")))[:args.num_images]
+    if len(image_files) == 0:
+        raise FileNotFoundError("No .png images in {}".format(args.images))
+
+    load_float = lambda: [to_log_image_float(cv2.imread(f, cv2.IMREAD_GRAYSCALE), args.log_eps) for f in image_files]
+    load_lut = lambda: [esim_torch.load_log_image(f, args.log_eps) for f in image_files]
+    t_float = timeit(load_float, args.repeats)
+    t_lut = timeit(load_lut, args.repeats)
+    print("decode + log transform of {} images from {}, best of {} runs".format(len(image_files), args.images, args.repeats))
+    print("float: {:.2f} ms/image, lut: {:.2f} ms/image".format(1e3 * t_float / len(image_files), 1e3 * t_lut / len(image_files)))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser("Benchmark of the log transform of 8 bit images, per pixel vs lookup table")
+    ap.add_argument("--sizes", type=int, nargs=2, action="append", default=None, metavar=("W", "H"),
+                    help="Sizes of the random images, default 640x480 and 1920x1080")
+    ap.add_argument("--images", default=None, help="Folder with .png images, additionally benchmarks decoding them")
+    ap.add_argument("--num_images", type=int, default=50)
+    ap.add_argument("--log_eps", type=float, default=1e-5)
+    ap.add_argument("--repeats", type=int, default=5)
+    args = ap.parse_args()
+    if args.sizes is None:
+        args.sizes = [(640, 480), (1920, 1080)]
+
+    bench_transform(args)
+    if args.images is not None:
+        bench_load(args)
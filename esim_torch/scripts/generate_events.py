@@ -1,10 +1,12 @@
 import argparse
-from operator import sub
+import functools
+import multiprocessing
 import os
+import time
 import esim_torch
 import numpy as np
 import glob
-import cv2
+import itertools
 import tqdm
 import torch
 
@@ -13,8 +15,69 @@ def is_valid_dir(subdirs, files):
     return len(subdirs) == 1 and len(files) == 1 and "timestamps.txt" in files and "imgs" in subdirs
 
 
-def process_dir(outdir, indir, args):
-    print(f"Processing folder {indir}... Generating events in {outdir}")
+def frames_per_batch(height, width, args):
+    # the simulator holds the log images and the reference values over time, 4 bytes per pixel each
+    bytes_per_frame = 2 * 4 * height * width
+    budget_frames = int(args.memory_budget_mb * 2**20) // bytes_per_frame
+    return max(1, min(args.batch_size, budget_frames))
+
+
+def to_numpy(events):
+    if events is None:
+        return {k: np.empty((0,), dtype=np.int64) for k in "xytp"}
+    return {k: v.cpu().numpy() for k, v in events.items()}
+
+
+def merge_events(pending, events):
+    # events of one window are sorted by time and then by pixel, keep that order across windows. The sort is stable,
+    # so events at the same time and pixel stay in the order they were generated in
+    if len(pending['t']) == 0:
+        return events
+    merged = {k: np.concatenate([pending[k], events[k]]) for k in "xytp"}
+    order = np.lexsort((merged['x'], merged['y'], merged['t']))
+    return {k: v[order] for k, v in merged.items()}
+
+
+def split_by_frame(events, frame_timestamps_ns):
+    # events are sorted by time, the events of a frame are those after the previous timestamp, up to and including
+    # its own. The first frame takes everything before, the last frame everything after
+    splits = np.searchsorted(events['t'], frame_timestamps_ns[:-1], side="right")
+    bounds = [0] + list(splits) + [len(events['t'])]
+    return [{k: v[i0:i1] for k, v in events.items()} for i0, i1 in zip(bounds[:-1], bounds[1:])]
+
+
+def read_stream_array(stream):
+    # arrays are sent in .npy format, see Upsampler._write_stream_array in upsampling/utils/upsampler.py
+    magic = stream.read(8)
+    if len(magic) == 0:
+        return None
+    if magic[:6] != b"\x93NUMPY":
+        raise ValueError("Invalid frame stream")
+    if (magic[6], magic[7]) == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    count = int(np.prod(shape))
+    data = stream.read(count * dtype.itemsize)
+    return np.frombuffer(data, dtype=dtype, count=count).reshape(shape)
+
+
+def read_stream(stream):
+    # yields (sequence name, timestamp in seconds, uint8 image) for every streamed frame
+    name = None
+    while True:
+        array = read_stream_array(stream)
+        if array is None:
+            return
+        if array.dtype.kind == "U":
+            name = str(array)
+            continue
+        image = read_stream_array(stream)
+        yield name, float(array), image
+
+
+def simulate(batches, outdir, pbar, args):
+    # batches yields (log images T x H x W, timestamps in ns) of consecutive frames of one sequence
     os.makedirs(outdir, exist_ok=True)
 
     # constructor
@@ -22,35 +85,218 @@ def process_dir(outdir, indir, args):
                            args.contrast_threshold_positive,
                            args.refractory_period_ns)
 
+    num_events = 0
+
+    writer = esim_torch.EventWriter(outdir) if args.output_format == "stream" else None
+
+    def write(frame_events):
+        nonlocal num_events, counter
+        num_events += len(frame_events['t'])
+
+        # do something with the events
+        if writer is not None:
+            writer.write(frame_events)
+        else:
+            np.savez(os.path.join(outdir, "%010d.npz" % counter), **frame_events)
+        counter += 1
+
+    # the timestamps of the simulator are rounded to float32, so the events of a window may end up slightly after
+    # its last frame timestamp. The last frame of every window is only written with the next window, so that
+    # such events still go to the frame that follows and the frames do not depend on the batch size
+    pending_events = to_numpy(None)
+    pending_timestamps_ns = np.empty((0,), dtype=np.int64)
+
+    counter = 0
+    for batch_idx, (log_images, batch_timestamps_ns) in enumerate(batches):
+        log_images = log_images.to(args.device, non_blocking=True)
+
+        events = esim.forward(log_images, torch.from_numpy(batch_timestamps_ns).to(args.device))
+
+        # the first image only initializes the simulator, every later image closes the interval of one frame
+        if batch_idx == 0:
+            batch_timestamps_ns = batch_timestamps_ns[1:]
+        if len(batch_timestamps_ns) == 0:
+            continue
+
+        pending_events = merge_events(pending_events, to_numpy(events))
+        pending_timestamps_ns = np.concatenate([pending_timestamps_ns, batch_timestamps_ns])
+
+        frames = split_by_frame(pending_events, pending_timestamps_ns)
+        for frame_events in frames[:-1]:
+            write(frame_events)
+        pending_events, pending_timestamps_ns = frames[-1], pending_timestamps_ns[-1:]
+
+        pbar.set_description(f"Num events generated: {num_events}")
+        pbar.update(len(batch_timestamps_ns))
+
+    if len(pending_timestamps_ns) > 0:
+        write(pending_events)
+
+    if writer is not None:
+        writer.close()
+
+
+def process_dir(outdir, indir, args):
+    print(f"Processing folder {indir}... Generating events in {outdir}")
+
     timestamps = np.genfromtxt(os.path.join(indir, "timestamps.txt"), dtype="float64")
     timestamps_ns = (timestamps * 1e9).astype("int64")
-    timestamps_ns = torch.from_numpy(timestamps_ns).cuda()
 
     image_files = sorted(glob.glob(os.path.join(indir, "imgs", "*.png")))
-    
+
+    load_log_image = functools.partial(esim_torch.load_log_image, log_eps=args.log_eps)
+    frame_shape = load_log_image(image_files[0]).shape
+    batch_size = frames_per_batch(*frame_shape, args)
+
+    # decode and log-transform the next batches while the current one is simulated
+    loader = esim_torch.PrefetchLoader(load_log_image, image_files, batch_size, frame_shape,
+                                       num_workers=args.num_workers,
+                                       queue_depth=args.prefetch_batches,
+                                       pin_memory=torch.device(args.device).type == "cuda")
+    batches = zip(loader, (timestamps_ns[start:start+batch_size] for start in range(0, len(image_files), batch_size)))
+
     pbar = tqdm.tqdm(total=len(image_files)-1)
-    num_events = 0
+    simulate(batches, outdir, pbar, args)
+    pbar.close()
+    print(f"Image loading: {loader.stats()}")
 
-    counter = 0
-    for image_file, timestamp_ns in zip(image_files, timestamps_ns):
-        image = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
-        log_image = np.log(image.astype("float32") / 255 + 1e-5)
-        log_image = torch.from_numpy(log_image).cuda()
 
-        sub_events = esim.forward(log_image, timestamp_ns)
+def find_jobs(input_dir):
+    # (input folder, number of frames) of every sequence, longest first so that long sequences do not delay the end of the run
+    jobs = []
+    for path, subdirs, files in os.walk(input_dir):
+        if is_valid_dir(subdirs, files):
+            jobs.append((path, len(glob.glob(os.path.join(path, "imgs", "*.png")))))
+    return sorted(jobs, key=lambda job: job[1], reverse=True)
 
-        # for the first image, no events are generated, so this needs to be skipped
-        if sub_events is None:
-            continue
 
-        sub_events = {k: v.cpu() for k, v in sub_events.items()}    
-        num_events += len(sub_events['t'])
- 
-        # do something with the events
-        np.savez(os.path.join(outdir, "%010d.npz" % counter), **sub_events)
-        pbar.set_description(f"Num events generated: {num_events}")
-        pbar.update(1)
-        counter += 1
+def cache_key(path, upstream_entry, args):
+    # events depend on the upsampled frames and the simulation parameters. The frames are identified by the key the
+    # upsampler recorded for them in its manifest entry, or by their content if they were not produced by
+    # upsampling/upsample.py.
+    params = dict(cn=args.contrast_threshold_negative, cp=args.contrast_threshold_positive,
+                  rp=args.refractory_period_ns, log_eps=args.log_eps, output_format=args.output_format)
+    if upstream_entry.get("status") == "done" and "key" in upstream_entry:
+        return esim_torch.manifest.cache_key([], dict(params, frames=upstream_entry["key"]))
+    filepaths = [os.path.join(path, "timestamps.txt")] + glob.glob(os.path.join(path, "imgs", "*.png"))
+    return esim_torch.manifest.cache_key(filepaths, params)
+
+
+def is_cached(manifest, path, num_frames, key, args):
+    # done with the same key and the events are still complete on disk
+    sequence = os.path.relpath(path, args.input_dir)
+    if not manifest.is_done(sequence, key):
+        return False
+    outdir = os.path.join(args.output_dir, sequence)
+    if args.output_format == "stream":
+        # frame_offsets.npy is written last, when the events are complete
+        return os.path.isfile(os.path.join(outdir, esim_torch.event_writer.FRAME_OFFSETS_FILENAME))
+    return len(glob.glob(os.path.join(outdir, "*.npz"))) == num_frames - 1
+
+
+def run_job(path, key, upstream_entry, args):
+    sequence = os.path.relpath(path, args.input_dir)
+    outdir = os.path.join(args.output_dir, sequence)
+    t_start = time.time()
+    try:
+        if key is None:
+            key = cache_key(path, upstream_entry, args)
+        # events of an earlier run with other parameters or another output format
+        stale_files = glob.glob(os.path.join(outdir, "*.npz")) + \
+            [os.path.join(outdir, f) for f in (esim_torch.event_writer.EVENTS_FILENAME, esim_torch.event_writer.FRAME_OFFSETS_FILENAME)]
+        for f in stale_files:
+            if os.path.isfile(f):
+                os.remove(f)
+        process_dir(outdir, path, args)
+    except Exception as e:
+        return sequence, "failed", dict(error=repr(e))
+    return sequence, "done", dict(key=key, seconds=round(time.time() - t_start, 3))
+
+
+_worker_args = None
+
+
+def init_worker(args, device_queue):
+    # every worker process simulates on its own device
+    global _worker_args
+    _worker_args = args
+    _worker_args.device = device_queue.get()
+
+
+def run_worker_job(job):
+    return run_job(*job, _worker_args)
+
+
+def process_dirs(args):
+    jobs = find_jobs(args.input_dir)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = esim_torch.Manifest(args.output_dir)
+    upstream_manifest = esim_torch.Manifest(args.input_dir)
+    upstream_entries = [upstream_manifest.get(os.path.relpath(path, args.input_dir)) for path, _ in jobs]
+    if args.resume:
+        # sequences simulated before from the same frames and parameters are reused
+        keys = [cache_key(path, upstream_entry, args) for (path, _), upstream_entry in zip(jobs, upstream_entries)]
+        cached = [is_cached(manifest, path, num_frames, key, args) for (path, num_frames), key in zip(jobs, keys)]
+        print(f"Resuming: reusing the events of {sum(cached)} sequences")
+    else:
+        # every job computes its own key, hashing the frames of all sequences here would delay the first job
+        keys = [None] * len(jobs)
+        cached = [False] * len(jobs)
+    jobs = [(path, key, upstream_entry) for (path, _), key, upstream_entry, is_job_cached
+            in zip(jobs, keys, upstream_entries, cached) if not is_job_cached]
+
+    if args.num_processes == 1:
+        results = (run_job(*job, args) for job in jobs)
+        pool = None
+    else:
+        context = multiprocessing.get_context("spawn")
+        device_queue = context.Queue()
+        devices = args.devices if args.devices is not None else [args.device]
+        for i in range(args.num_processes):
+            device_queue.put(devices[i % len(devices)])
+        pool = context.Pool(args.num_processes, initializer=init_worker, initargs=(args, device_queue))
+        results = pool.imap_unordered(run_worker_job, jobs)
+
+    failed = []
+    for sequence, status, info in results:
+        manifest.update(sequence, status, **info)
+        if status != "done":
+            print(f"Generating events for {sequence} failed: {info['error']}")
+            failed.append(sequence)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if len(failed) > 0:
+        raise RuntimeError(f"Generating events failed for {len(failed)} sequences: {', '.join(failed)}")
+
+
+def stream_batches(frames, args):
+    # groups the streamed frames of one sequence into batches
+    first_frame = next(frames, None)
+    if first_frame is None:
+        return
+    batch_size = frames_per_batch(*first_frame[2].shape, args)
+    frames = itertools.chain([first_frame], frames)
+
+    while True:
+        batch = list(itertools.islice(frames, batch_size))
+        if len(batch) == 0:
+            return
+        log_images = torch.from_numpy(np.stack([esim_torch.to_log_image(image, args.log_eps) for _, _, image in batch]))
+        timestamps_ns = (np.array([timestamp for _, timestamp, _ in batch], dtype="float64") * 1e9).astype("int64")
+        yield log_images, timestamps_ns
+
+
+def process_stream(stream, args):
+    for name, frames in itertools.groupby(read_stream(stream), key=lambda frame: frame[0]):
+        outdir = os.path.join(args.output_dir, name)
+        print(f"Processing streamed sequence {name}... Generating events in {outdir}")
+
+        pbar = tqdm.tqdm()
+        simulate(stream_batches(frames, args), outdir, pbar, args)
+        pbar.close()
 
 
 if __name__ == "__main__":
@@ -58,15 +304,36 @@ if __name__ == "__main__":
     parser.add_argument("--contrast_threshold_negative", "-cn", type=float, default=0.2)
     parser.add_argument("--contrast_threshold_positive", "-cp", type=float, default=0.2)
     parser.add_argument("--refractory_period_ns", "-rp", type=int, default=0)
-    parser.add_argument("--input_dir", "-i", default="", required=True)
+    parser.add_argument("--log_eps", type=float, default=1e-5, help="Log images are log(image / 255 + log_eps)")
+    parser.add_argument("--input_dir", "-i", default=None)
+    parser.add_argument("--input_stream", "-s", default=None,
+                        help="File or named pipe with frames streamed by upsampling/upsample.py --stream, instead of --input_dir")
     parser.add_argument("--output_dir", "-o", default="", required=True)
+    parser.add_argument("--device", "-d", default="cuda", help="Torch device, e.g. cuda, cuda:1 or cpu")
+    parser.add_argument("--batch_size", "-b", type=int, default=64, help="Number of frames simulated per call")
+    parser.add_argument("--memory_budget_mb", type=float, default=2048,
+                        help="Upper bound for the image memory of one call, reduces the batch size for large frames")
+    parser.add_argument("--num_workers", type=int, default=4, help="Threads decoding images ahead of the simulator")
+    parser.add_argument("--prefetch_batches", type=int, default=2, help="Number of batches loaded ahead")
+    parser.add_argument("--output_format", choices=["stream", "npz"], default="stream",
+                        help="stream: one memory-mappable events.npy per sequence, npz: one file per frame")
+    parser.add_argument("--num_processes", type=int, default=1,
+                        help="Number of sequences simulated in parallel, longest sequences first. Only with --input_dir")
+    parser.add_argument("--devices", nargs="+", default=None,
+                        help="Torch devices assigned round robin to the worker processes, e.g. cuda:0 cuda:1. Defaults to --device")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip sequences whose events an earlier run generated from the same frames and parameters, see manifest.jsonl in the output directory")
     args = parser.parse_args()
+    if (args.input_dir is None) == (args.input_stream is None):
+        parser.error("Exactly one of --input_dir and --input_stream is required")
+    if args.num_processes > 1 and args.input_stream is not None:
+        parser.error("--num_processes > 1 can not be combined with --input_stream")
 
 
-    print(f"Generating events with cn={args.contrast_threshold_negative}, cp={args.contrast_threshold_positive} and rp={args.refractory_period_ns}")
-
-    for path, subdirs, files in os.walk(args.input_dir):
-        if is_valid_dir(subdirs, files):
-            output_folder = os.path.join(args.output_dir, os.path.relpath(path, args.input_dir))
+    print(f"Generating events with cn={args.contrast_threshold_negative}, cp={args.contrast_threshold_positive} and rp={args.refractory_period_ns} on {args.device}")
 
-            process_dir(output_folder, path, args)
+    if args.input_stream is not None:
+        with open(args.input_stream, "rb") as stream:
+            process_stream(stream, args)
+    else:
+        process_dirs(args)
@@ -1,21 +1,31 @@
 from setuptools import setup
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+from torch.utils.cpp_extension import BuildExtension, CUDAExtension, CUDA_HOME
 
-setup(
-    name='esim_torch',
-    package_dir={'':'src'},
-    packages=['esim_torch'],
-    ext_modules=[
+# The CUDA kernels are optional: without a CUDA toolkit only the CPU backend (esim_cpu.py) is installed.
+ext_modules = []
+if CUDA_HOME is not None:
+    ext_modules.append(
         CUDAExtension(name='esim_cuda',
                       sources=[
                       'src/esim_torch/esim_cuda_kernel.cu',
                       ],
-                     # extra_compile_args={
-                     #'cxx': ['-g'],
-                     #'nvcc': ['-arch=sm_60', '-O3', '-use_fast_math']
-                     #}
-                     )
-    ],
+                      # no fused multiply-add, so that the CUDA kernels round exactly like the CPU backend
+                      extra_compile_args={
+                      'cxx': [],
+                      'nvcc': ['-fmad=false']
+                      }
+                      # extra_compile_args={
+                      #'cxx': ['-g'],
+                      #'nvcc': ['-arch=sm_60', '-O3', '-use_fast_math']
+                      #}
+                      )
+    )
+
+setup(
+    name='esim_torch',
+    package_dir={'':'src'},
+    packages=['esim_torch'],
+    ext_modules=ext_modules,
     cmdclass={
         'build_ext': BuildExtension
     })
@@ -1 +1,5 @@
-from .esim_torch import EventSimulator_torch as ESIM
\ No newline at end of file
+from .esim_torch import EventSimulator_torch as ESIM
+from .event_writer import EventWriter
+from .log_image import load_log_image, to_log_image
+from .manifest import Manifest
+from .prefetch import PrefetchLoader
\ No newline at end of file
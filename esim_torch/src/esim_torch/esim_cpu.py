@@ -0,0 +1,188 @@
+import torch
+
+
+# CPU counterpart of the esim_cuda extension. Both passes mirror the CUDA kernels operation by operation
+# in float32, vectorized over pixels instead of launching one thread per pixel, so that both backends
+# produce identical events. Parallelism comes from torch's intra-op thread pool (torch.set_num_threads).
+# The state is stacked over K configurations (K x H x W), every configuration has its own contrast thresholds and
+# refractory period (tensors of K values), and pixel k*H*W + i of the state belongs to pixel i of the images.
+#
+# In mostly static scenes few pixels cross a threshold within a batch. Both passes then only simulate the active
+# states, those that can cross a threshold somewhere in the batch, and leave the others as they are. The caller finds
+# them once per batch with active_states and passes them to both. This skips work, not events: the events are
+# identical to the dense simulation. Batches with more than SPARSE_MAX_ACTIVE_FRACTION active states are simulated
+# densely (active is None), where gathering the states costs more than it saves.
+
+SPARSE_MAX_ACTIVE_FRACTION = 0.2
+
+
+def _check_input(x, name):
+    assert not x.is_cuda, name + " must be a CPU tensor"
+    assert x.is_contiguous(), name + " must be contiguous"
+
+
+def _step(img, ref, ct_neg, ct_pos):
+    # number of threshold crossings between the reference value and the new image, see count_events_cuda_forward_kernel
+    positive = img >= ref
+    ct = torch.where(positive, ct_pos, ct_neg)
+    polarity = torch.where(positive, 1, -1)
+    num_events = (torch.abs(img - ref) / ct).long()
+    return polarity, ct, num_events
+
+
+def active_states(imgs,       # T x H x W
+                  init_refs,  # K x H x W
+                  ct_neg,     # K
+                  ct_pos):    # K
+    # Flat indices of the states that can cross a threshold in imgs[1:], or None if there are too many for the sparse
+    # simulation. A state without crossings keeps its reference, so it crosses iff the brightest or darkest image
+    # reaches a threshold from the initial reference. Rounding is monotonic, so testing the extremes with the
+    # operations of _step finds exactly the states with crossings.
+    if SPARSE_MAX_ACTIVE_FRACTION <= 0:
+        return None
+    ct_neg = ct_neg.view(-1, 1, 1)
+    ct_pos = ct_pos.view(-1, 1, 1)
+    img_max = imgs[1:].amax(dim=0)
+    img_min = imgs[1:].amin(dim=0)
+    crosses_pos = (img_max >= init_refs) & ((torch.abs(img_max - init_refs) / ct_pos).long() > 0)
+    crosses_neg = (img_min < init_refs) & ((torch.abs(img_min - init_refs) / ct_neg).long() > 0)
+    active = torch.nonzero((crosses_pos | crosses_neg).view(-1)).view(-1)
+    if active.numel() > SPARSE_MAX_ACTIVE_FRACTION * init_refs.numel():
+        return None
+    return active
+
+
+def forward_count_events(imgs,            # T x H x W
+                         init_refs,       # K x H x W
+                         refs_over_time,  # T-1 x K x H x W
+                         count_ev,        # K x H x W
+                         ct_neg,          # K
+                         ct_pos,          # K
+                         active):         # see active_states, None: all states
+    _check_input(imgs, "imgs")
+    _check_input(init_refs, "init_refs")
+    _check_input(refs_over_time, "refs_over_time")
+    _check_input(count_ev, "count_ev")
+
+    T = imgs.shape[0]
+    ct_neg = ct_neg.view(-1, 1, 1)
+    ct_pos = ct_pos.view(-1, 1, 1)
+
+    if active is not None:
+        return _forward_count_events_sparse(imgs, init_refs, refs_over_time, count_ev, ct_neg, ct_pos, active)
+
+    ref = init_refs.clone()
+    count_ev.zero_()
+    for t in range(T-1):
+        polarity, ct, num_events = _step(imgs[t+1], ref, ct_neg, ct_pos)
+        ref += polarity * ct * num_events.to(imgs.dtype)
+
+        # refs_t stores the reference at t+1, count_ev the number of events over all timesteps.
+        # The image broadcasts over the configurations.
+        refs_over_time[t] = ref
+        count_ev += num_events
+
+    return [refs_over_time, count_ev]
+
+
+def _forward_count_events_sparse(imgs, init_refs, refs_over_time, count_ev, ct_neg, ct_pos, active):
+    # forward_count_events of the active states, the others keep their reference and have no events
+    T, H, W = imgs.shape
+    config, pixel = active // (H * W), active % (H * W)
+    ct_neg = ct_neg.view(-1)[config]
+    ct_pos = ct_pos.view(-1)[config]
+    imgs = imgs.view(T, -1)
+
+    refs_over_time.copy_(init_refs.expand_as(refs_over_time))
+    ref = init_refs.view(-1)[active]
+    count = torch.zeros_like(active)
+    for t in range(T-1):
+        polarity, ct, num_events = _step(imgs[t+1][pixel], ref, ct_neg, ct_pos)
+        ref += polarity * ct * num_events.to(imgs.dtype)
+
+        refs_over_time[t].view(-1)[active] = ref
+        count += num_events
+
+    count_ev.zero_()
+    count_ev.view(-1)[active] = count
+    return [refs_over_time, count_ev]
+
+
+def forward(imgs,            # T x H x W
+            ts,              # T
+            init_refs,       # K x H x W
+            refs_over_time,  # T-1 x K x H x W
+            offsets,         # K x H x W
+            ev,              # N x 4, x y t p
+            t_last_ev,       # K x H x W
+            ct_neg,          # K
+            ct_pos,          # K
+            dt_ref,          # K
+            candidates):     # see active_states, None: all states
+    _check_input(imgs, "imgs")
+    _check_input(ts, "ts")
+    _check_input(init_refs, "init_refs")
+    _check_input(refs_over_time, "refs_over_time")
+    _check_input(offsets, "offsets")
+    _check_input(ev, "ev")
+    _check_input(t_last_ev, "t_last_ev")
+
+    T, H, W = imgs.shape
+    ct_neg = ct_neg.view(-1, 1, 1)
+    ct_pos = ct_pos.view(-1, 1, 1)
+
+    offset = offsets.view(-1).clone()
+    t_last = t_last_ev.view(-1)
+
+    # states that can have events in this batch
+    if candidates is not None:
+        candidate_config, candidate_pixel = candidates // (H * W), candidates % (H * W)
+        candidate_ct_neg = ct_neg.view(-1)[candidate_config]
+        candidate_ct_pos = ct_pos.view(-1)[candidate_config]
+
+    for t in range(T-1):
+        i0 = imgs[t].view(-1)
+        i1 = imgs[t+1].view(-1)
+        ref0 = init_refs if t == 0 else refs_over_time[t-1]
+
+        t0 = ts[t]
+        t1 = ts[t+1]
+
+        if candidates is None:
+            polarity, ct, num_events = (v.reshape(-1) for v in _step(imgs[t+1], ref0, ct_neg, ct_pos))
+            ref0 = ref0.reshape(-1)
+        else:
+            ref0 = ref0.reshape(-1)[candidates]
+            polarity, ct, num_events = _step(i1[candidate_pixel], ref0, candidate_ct_neg, candidate_ct_pos)
+
+        # only states with crossings take part, the k-th crossing of every state is handled in one step.
+        # active indexes the candidates, states the state of each
+        active = torch.nonzero(num_events).view(-1)
+        for ev_idx in range(int(num_events.max()) if active.numel() > 0 else 0):
+            active = active[num_events[active] > ev_idx]
+            states = active if candidates is None else candidates[active]
+            config, pixel = states // (H * W), states % (H * W)
+
+            p = polarity[active]
+            i0_active = i0[pixel]
+            r = (ref0[active] + ((ev_idx+1) * p).to(imgs.dtype) * ct[active] - i0_active) / (i1[pixel] - i0_active)
+            timestamp = (t0.to(imgs.dtype) + (t1-t0).to(imgs.dtype) * r).long()
+
+            t_prev = t_last[states]
+            emit = ((timestamp - t_prev) > dt_ref[config]) | (t_prev == 0)
+
+            states = states[emit]
+            pixel = pixel[emit]
+            idx = offset[states] + ev_idx
+            ev[idx, 0] = pixel % W
+            ev[idx, 1] = pixel // W
+            ev[idx, 2] = timestamp[emit]
+            ev[idx, 3] = p[emit]
+            t_last[states] = timestamp[emit]
+
+        if candidates is None:
+            offset += num_events
+        else:
+            offset[candidates] += num_events
+
+    return ev
@@ -4,7 +4,7 @@
 
 // CUDA forward declarations
 
-std::vector<torch::Tensor> esim_forward(
+torch::Tensor esim_forward(
     const torch::Tensor& images,
     const torch::Tensor& timestamps,
     const torch::Tensor& init_reference_values,
@@ -12,19 +12,17 @@ std::vector<torch::Tensor> esim_forward(
     const torch::Tensor& offsets,
     torch::Tensor& events,
     torch::Tensor& timestamps_last_event,
-    float contrast_threshold_negative,
-    float contrast_threshold_positive,
-    int64_t refractory_period);
+    const torch::Tensor& contrast_thresholds_negative,
+    const torch::Tensor& contrast_thresholds_positive,
+    const torch::Tensor& refractory_periods);
 
 std::vector<torch::Tensor> esim_forward_count_events(
     const torch::Tensor& images,
-    const torch::Tensor& timestamps,
     const torch::Tensor& init_reference_values,
-    torch::Tensor& reference_values_over_time
+    torch::Tensor& reference_values_over_time,
     torch::Tensor& event_counts,
-    torch::Tensor& timestamps_last_event,
-    float contrast_threshold_negative,
-    float contrast_threshold_positive);
+    const torch::Tensor& contrast_thresholds_negative,
+    const torch::Tensor& contrast_thresholds_positive);
 
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
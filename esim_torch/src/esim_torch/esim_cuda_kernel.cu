@@ -11,6 +11,11 @@
 #define CHECK_INPUT(x) CHECK_CUDA(x); CHECK_CONTIGUOUS(x)
 #define CHECK_DEVICE(x, y) AT_ASSERTM(x.device().index() == y.device().index(), #x " and " #y " must be in same CUDA device")
 
+/*
+The state is stacked over K configurations: one thread per configuration and pixel, thread k*H*W + i simulates
+pixel i of the images with the contrast thresholds and refractory period of configuration k.
+*/
+
 /*
 Precompute the reference values and number of events between the reference values to read out easily after
 */
@@ -20,21 +25,27 @@ __global__ void count_events_cuda_forward_kernel(
     const scalar_t* __restrict__ init_refs,
     scalar_t* __restrict__ refs_over_time,
     int64_t* __restrict__ count_ev, 
-    int T, int H, int W, float ct_neg, float ct_pos)
+    const float* __restrict__ cts_neg,
+    const float* __restrict__ cts_pos,
+    int T, int K, int H, int W)
 {
   // linear index
   const int linIdx = blockIdx.x * blockDim.x + threadIdx.x;
   
   // check that thread is not out of valid range
-  if (linIdx >= H * W)
+  if (linIdx >= K * H * W)
     return;
 
+  const int pixIdx = linIdx % (H * W);
+  const float ct_neg = cts_neg[linIdx / (H * W)];
+  const float ct_pos = cts_pos[linIdx / (H * W)];
+
   scalar_t ref = init_refs[linIdx];
   int tot_num_events = 0;
   for (int t=0; t<T-1; t++)
   {
-    int tidx = (t+1) * H * W + linIdx;
-    int tidx_min_1 = t * H * W + linIdx;
+    int tidx = (t+1) * H * W + pixIdx;
+    int tidx_min_1 = t * H * W + pixIdx;
 
     scalar_t i0 = imgs[tidx_min_1];
     scalar_t i1 = imgs[tidx];
@@ -51,7 +62,7 @@ __global__ void count_events_cuda_forward_kernel(
     // store number of events and reference values for later
     // triggered_events_t stores the number of events between t-1 and t
     // refs_t stores the reference at t.
-    refs_over_time[tidx_min_1] = ref;
+    refs_over_time[t * K * H * W + linIdx] = ref;
   }
   count_ev[linIdx] = tot_num_events;
 }
@@ -66,18 +77,26 @@ __global__ void esim_cuda_forward_kernel(
   const int64_t* __restrict__ offsets,
   int64_t* __restrict__ ev,
   int64_t* __restrict__ t_last_ev,
-  int T, int H, int W, float ct_neg, float ct_pos, int64_t t_ref
+  const float* __restrict__ cts_neg,
+  const float* __restrict__ cts_pos,
+  const int64_t* __restrict__ t_refs,
+  int T, int K, int H, int W
 ) 
 {
   // linear index
   const int linIdx = blockIdx.x * blockDim.x + threadIdx.x;
 
   // check that thread is not out of valid range
-  if (linIdx >= H * W)
+  if (linIdx >= K * H * W)
     return;
 
-  int x = linIdx % W;
-  int y = linIdx / W;
+  const int pixIdx = linIdx % (H * W);
+  const float ct_neg = cts_neg[linIdx / (H * W)];
+  const float ct_pos = cts_pos[linIdx / (H * W)];
+  const int64_t t_ref = t_refs[linIdx / (H * W)];
+
+  int x = pixIdx % W;
+  int y = pixIdx / W;
 
   scalar_t ref0 = init_ref[linIdx];
   int64_t offset = offsets[linIdx];
@@ -86,14 +105,14 @@ __global__ void esim_cuda_forward_kernel(
   
     // offset_t stores the offset at t.
 
-    scalar_t i0 = imgs[linIdx+(t)*H*W]; // shifts forward one timestamp 
-    scalar_t i1 = imgs[linIdx+(t+1)*H*W]; // shifts forward one timestamp 
+    scalar_t i0 = imgs[pixIdx+(t)*H*W]; // shifts forward one timestamp 
+    scalar_t i1 = imgs[pixIdx+(t+1)*H*W]; // shifts forward one timestamp 
 
     int64_t t0 = ts[t];
     int64_t t1 = ts[t+1];
     
     if (t > 0) {
-      ref0 = refs_over_time[linIdx+(t-1)*H*W];
+      ref0 = refs_over_time[linIdx+(t-1)*K*H*W];
     }
 
     int polarity = (i1 >= ref0) ? 1 : -1;
@@ -124,37 +143,44 @@ __global__ void esim_cuda_forward_kernel(
 
 std::vector<torch::Tensor> esim_forward_count_events(
   const torch::Tensor& imgs,       // T x H x W
-  const torch::Tensor& init_refs,  // H x W
-  torch::Tensor& refs_over_time,   // T-1 x H x W
-  torch::Tensor& count_ev,         // H x W
-  float ct_neg,
-  float ct_pos)
+  const torch::Tensor& init_refs,  // K x H x W
+  torch::Tensor& refs_over_time,   // T-1 x K x H x W
+  torch::Tensor& count_ev,         // K x H x W
+  const torch::Tensor& ct_neg,     // K
+  const torch::Tensor& ct_pos)     // K
 {
   CHECK_INPUT(imgs);
   CHECK_INPUT(count_ev);
   CHECK_INPUT(init_refs);
   CHECK_INPUT(refs_over_time);
+  CHECK_INPUT(ct_neg);
+  CHECK_INPUT(ct_pos);
   CHECK_DEVICE(imgs, count_ev);
   CHECK_DEVICE(imgs, init_refs);
   CHECK_DEVICE(imgs, refs_over_time);
+  CHECK_DEVICE(imgs, ct_neg);
+  CHECK_DEVICE(imgs, ct_pos);
 
   //cudaSetDevice(imgs.device().index());
   
   unsigned T = imgs.size(0);
   unsigned H = imgs.size(1);
   unsigned W = imgs.size(2);
+  unsigned K = init_refs.size(0);
   
   //unsigned MAX_NUM_EVENTS = ev.size(1);
   
   unsigned threads = 256;
-  dim3 blocks((H * W + threads - 1) / threads, 1);
+  dim3 blocks((K * H * W + threads - 1) / threads, 1);
 
   count_events_cuda_forward_kernel<float><<<blocks, threads>>>(
       imgs.data<float>(), 
       init_refs.data<float>(),
       refs_over_time.data<float>(),
       count_ev.data<int64_t>(),
-      T, H, W, ct_neg, ct_pos
+      ct_neg.data<float>(),
+      ct_pos.data<float>(),
+      T, K, H, W
     );
 
   return {refs_over_time, count_ev};
@@ -163,14 +189,14 @@ std::vector<torch::Tensor> esim_forward_count_events(
 torch::Tensor esim_forward(
     const torch::Tensor& imgs, // T x H x W
     const torch::Tensor& ts, // T
-    const torch::Tensor& init_refs, // H x W
-    const torch::Tensor& refs_over_time, // T-1 x H x W
-    const torch::Tensor& offsets, // H x W 
+    const torch::Tensor& init_refs, // K x H x W
+    const torch::Tensor& refs_over_time, // T-1 x K x H x W
+    const torch::Tensor& offsets, // K x H x W 
     torch::Tensor& ev,  // N x 4, x y t p
-    torch::Tensor& t_last_ev,  // H x W
-    float ct_neg,
-    float ct_pos,
-    int64_t dt_ref
+    torch::Tensor& t_last_ev,  // K x H x W
+    const torch::Tensor& ct_neg, // K
+    const torch::Tensor& ct_pos, // K
+    const torch::Tensor& dt_ref // K
   ) 
 {
   CHECK_INPUT(imgs);
@@ -179,6 +205,9 @@ torch::Tensor esim_forward(
   CHECK_INPUT(offsets);
   CHECK_INPUT(refs_over_time);
   CHECK_INPUT(init_refs);
+  CHECK_INPUT(ct_neg);
+  CHECK_INPUT(ct_pos);
+  CHECK_INPUT(dt_ref);
   
   CHECK_DEVICE(imgs, ts);
   CHECK_DEVICE(imgs, ev);
@@ -186,15 +215,19 @@ torch::Tensor esim_forward(
   CHECK_DEVICE(imgs, init_refs);
   CHECK_DEVICE(imgs, refs_over_time);
   CHECK_DEVICE(imgs, t_last_ev);
+  CHECK_DEVICE(imgs, ct_neg);
+  CHECK_DEVICE(imgs, ct_pos);
+  CHECK_DEVICE(imgs, dt_ref);
 
   //cudaSetDevice(imgs.device().index());
 
   unsigned T = imgs.size(0);
   unsigned H = imgs.size(1);
   unsigned W = imgs.size(2);
+  unsigned K = init_refs.size(0);
 
   unsigned threads = 256;
-  dim3 blocks((H * W + threads - 1) / threads, 1);
+  dim3 blocks((K * H * W + threads - 1) / threads, 1);
 
   esim_cuda_forward_kernel<float><<<blocks, threads>>>(
       imgs.data<float>(),
@@ -204,7 +237,10 @@ torch::Tensor esim_forward(
       offsets.data<int64_t>(),
       ev.data<int64_t>(),
       t_last_ev.data<int64_t>(),
-      T, H, W, ct_neg, ct_pos, dt_ref
+      ct_neg.data<float>(),
+      ct_pos.data<float>(),
+      dt_ref.data<int64_t>(),
+      T, K, H, W
     );
   
   return ev;
@@ -1,12 +1,49 @@
 import torch
-import esim_cuda
+
+from . import esim_cpu
+
+try:
+    import esim_cuda
+except ImportError:
+    # CPU-only installation, see setup.py
+    esim_cuda = None
+
+
+def _as_list(value):
+    # scalar or sequence of values -> list of values
+    if torch.is_tensor(value):
+        return value.reshape(-1).tolist()
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
 
 
 class EventSimulator_torch(torch.nn.Module):
+    """
+    Simulates events from log images. The contrast thresholds and the refractory period are either numbers,
+    or sequences of K values (numbers are used for all K), which simulates K configurations in one pass over the
+    images. forward then returns a list with the events of each configuration instead of the events.
+    """
+
     def __init__(self, contrast_threshold_neg=0.2, contrast_threshold_pos=0.2, refractory_period_ns=0):
-        self.contrast_threshold_neg = contrast_threshold_neg
-        self.contrast_threshold_pos = contrast_threshold_pos
-        self.refractory_period_ns = int(refractory_period_ns)
+        self.multi_config = any(torch.is_tensor(v) and v.dim() > 0 or isinstance(v, (list, tuple))
+                                for v in (contrast_threshold_neg, contrast_threshold_pos, refractory_period_ns))
+
+        configs = [_as_list(v) for v in (contrast_threshold_neg, contrast_threshold_pos, refractory_period_ns)]
+        self.num_configs = max(len(c) for c in configs)
+        if any(len(c) not in (1, self.num_configs) for c in configs):
+            raise ValueError("contrast_threshold_neg, contrast_threshold_pos and refractory_period_ns must have "
+                             "the same number of values, got {}".format([len(c) for c in configs]))
+        configs = [c * self.num_configs if len(c) == 1 else c for c in configs]
+
+        if self.multi_config:
+            self.contrast_threshold_neg = [float(v) for v in configs[0]]
+            self.contrast_threshold_pos = [float(v) for v in configs[1]]
+            self.refractory_period_ns = [int(v) for v in configs[2]]
+        else:
+            self.contrast_threshold_neg = contrast_threshold_neg
+            self.contrast_threshold_pos = contrast_threshold_pos
+            self.refractory_period_ns = int(refractory_period_ns)
 
         self.initial_reference_values = None
         self.timestamps_last_event = None
@@ -34,7 +71,8 @@ class EventSimulator_torch(torch.nn.Module):
         self._check_inputs(images, timestamps)
 
         if self.initial_reference_values is None:
-            self.initial_reference_values = images[0].clone()
+            # one reference value and last event timestamp per configuration and pixel, K x H x W
+            self.initial_reference_values = images[0].repeat(self.num_configs, 1, 1)
             self.timestamps_last_event = torch.zeros_like(self.initial_reference_values).long()
 
         if self.last_image is not None:
@@ -53,49 +91,80 @@ class EventSimulator_torch(torch.nn.Module):
 
         return events
 
+    @staticmethod
+    def _backend(images):
+        if not images.is_cuda:
+            return esim_cpu
+        if esim_cuda is None:
+            raise RuntimeError("esim_cuda is not installed, move the images to the CPU or rebuild esim_torch with CUDA.")
+        return esim_cuda
+
+    def _config_tensors(self, device):
+        # per-configuration parameters of the backends, K values each
+        ct_neg, ct_pos, refractory_period_ns = (_as_list(v) for v in (self.contrast_threshold_neg,
+                                                                      self.contrast_threshold_pos,
+                                                                      self.refractory_period_ns))
+        return (torch.tensor(ct_neg, dtype=torch.float32, device=device),
+                torch.tensor(ct_pos, dtype=torch.float32, device=device),
+                torch.tensor(refractory_period_ns, dtype=torch.int64, device=device))
+
     def initialized_forward(self, images, timestamps):
+        backend = self._backend(images)
 
         T, H, W = images.shape
-        reference_values_over_time = torch.zeros((T-1, H, W),
+        K = self.num_configs
+        ct_neg, ct_pos, refractory_period_ns = self._config_tensors(images.device)
+
+        reference_values_over_time = torch.zeros((T-1, K, H, W),
                                                  device=images.device,
                                                  dtype=images.dtype)
 
-        event_counts = torch.zeros_like(images[0]).long()
+        event_counts = torch.zeros_like(self.initial_reference_values).long()
+
+        # the CPU backend only simulates the states that cross a threshold in this batch, found once for both passes
+        sparse_args = ()
+        if backend is esim_cpu:
+            sparse_args = (esim_cpu.active_states(images, self.initial_reference_values, ct_neg, ct_pos),)
 
-        reference_values_over_time, event_counts = esim_cuda.forward_count_events(images, 
-                                                                                  self.initial_reference_values,
-                                                                                  reference_values_over_time,
-                                                                                  event_counts,
-                                                                                  self.contrast_threshold_neg,
-                                                                                  self.contrast_threshold_pos)
+        reference_values_over_time, event_counts = backend.forward_count_events(images,
+                                                                                self.initial_reference_values,
+                                                                                reference_values_over_time,
+                                                                                event_counts,
+                                                                                ct_neg,
+                                                                                ct_pos,
+                                                                                *sparse_args)
 
-        # compute the offsets for each event group
+        # compute the offsets for each event group, the events of each configuration are stored in one block
         cumsum = event_counts.view(-1).cumsum(dim=0)
         total_num_events = cumsum[-1]
-        offsets = cumsum.view(H, W) - event_counts
+        offsets = cumsum.view(K, H, W) - event_counts
 
-        # compute events on the GPU
+        # compute events on the device of the images
         events = torch.zeros((total_num_events, 4), device=cumsum.device, dtype=cumsum.dtype)
 
-        events = esim_cuda.forward(images,
-                                   timestamps,
-                                   self.initial_reference_values,
-                                   reference_values_over_time,
-                                   offsets,
-                                   events,
-                                   self.timestamps_last_event,
-                                   self.contrast_threshold_neg,
-                                   self.contrast_threshold_pos,
-                                   self.refractory_period_ns)
-
+        events = backend.forward(images,
+                                 timestamps,
+                                 self.initial_reference_values,
+                                 reference_values_over_time,
+                                 offsets,
+                                 events,
+                                 self.timestamps_last_event,
+                                 ct_neg,
+                                 ct_pos,
+                                 refractory_period_ns,
+                                 *sparse_args)
 
-        # sort by timestamps. Do this for each batch of events
-        if len(events) == 0:
-            return None
+        self.initial_reference_values = reference_values_over_time[-1]
 
-        events = events[events[:,2].argsort()]
-        events = events[events[:,2]>0]
+        outputs = []
+        for config_events in events.split(event_counts.view(K, -1).sum(dim=1).tolist()):
+            # sort by timestamps. Do this for each batch of events
+            if len(config_events) == 0:
+                outputs.append(None)
+                continue
 
-        self.initial_reference_values = reference_values_over_time[-1]
+            config_events = config_events[config_events[:,2].argsort(stable=True)]
+            config_events = config_events[config_events[:,2]>0]
+            outputs.append(dict(zip(['x','y','t','p'], config_events.T)))
 
-        return dict(zip(['x','y','t','p'], events.T))
\ No newline at end of file
+        return outputs if self.multi_config else outputs[0]
@@ -0,0 +1,118 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+
+EVENTS_FILENAME = "events.npy"
+FRAME_OFFSETS_FILENAME = "frame_offsets.npy"
+
+EVENT_DTYPE = np.dtype([("t", "<i8"), ("x", "<u2"), ("y", "<u2"), ("p", "i1")])
+
+# fixed size of the .npy header, so that the final number of events can be patched in place on close
+_HEADER_SIZE = 256
+
+
+def _npy_header(num_events):
+    header = repr({"descr": np.lib.format.dtype_to_descr(EVENT_DTYPE),
+                   "fortran_order": False,
+                   "shape": (int(num_events),)})
+    magic = b"\x93NUMPY\x01\x00"
+    header_len = _HEADER_SIZE - len(magic) - 2
+    header = header.ljust(header_len - 1) + "\n"
+    return magic + struct.pack("<H", header_len) + header.encode("latin1")
+
+
+class EventWriter:
+    """
+    Append-only event store with one file per sequence, written by a background thread.
+
+    - events.npy holds packed records (t int64 ns, x/y uint16, p int8) and can be
+      memory-mapped with np.load(path, mmap_mode="r").
+    - frame_offsets.npy holds N+1 offsets, events of the i-th write are [offsets[i], offsets[i+1]).
+    - events are buffered and handed to the writer thread in chunks of chunk_size events.
+    """
+
+    def __init__(self, outdir: str, chunk_size: int = 1 << 20, max_queued_chunks: int = 4):
+        os.makedirs(outdir, exist_ok=True)
+        self.outdir = outdir
+        self.chunk_size = int(chunk_size)
+
+        self._file = open(os.path.join(outdir, EVENTS_FILENAME), "wb")
+        self._file.write(_npy_header(0))
+
+        self._chunk = np.empty((self.chunk_size,), dtype=EVENT_DTYPE)
+        self._chunk_fill = 0
+        self._frame_offsets = [0]
+
+        self._queue = queue.Queue(maxsize=max_queued_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_events(self):
+        return self._frame_offsets[-1]
+
+    def write(self, events):
+        self._raise_thread_error()
+
+        n = len(events["t"])
+        start = 0
+        while start < n:
+            stop = min(n, start + self.chunk_size - self._chunk_fill)
+            dst = self._chunk[self._chunk_fill:self._chunk_fill + stop - start]
+            for k in EVENT_DTYPE.names:
+                dst[k] = events[k][start:stop]
+            self._chunk_fill += stop - start
+            start = stop
+
+            if self._chunk_fill == self.chunk_size:
+                self._flush_chunk()
+
+        self._frame_offsets.append(self._frame_offsets[-1] + n)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._chunk_fill > 0:
+            self._flush_chunk()
+        self._queue.put(None)
+        self._thread.join()
+
+        self._file.seek(0)
+        self._file.write(_npy_header(self.num_events))
+        self._file.close()
+        self._file = None
+        self._raise_thread_error()
+
+        np.save(os.path.join(self.outdir, FRAME_OFFSETS_FILENAME), np.asarray(self._frame_offsets, dtype=np.int64))
+
+    def _flush_chunk(self):
+        self._queue.put(self._chunk[:self._chunk_fill])
+        self._chunk = np.empty((self.chunk_size,), dtype=EVENT_DTYPE)
+        self._chunk_fill = 0
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._file.write(chunk.tobytes())
+            except Exception as e:
+                self._error = e
+
+    def _raise_thread_error(self):
+        if self._error is not None:
+            raise RuntimeError("Writing events to {} failed".format(self.outdir)) from self._error
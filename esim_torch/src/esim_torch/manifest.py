@@ -0,0 +1,48 @@
+import hashlib
+import json
+import os
+
+
+class Manifest:
+    """Status of every sequence of a run, appended as json lines so that an interrupted run can be resumed.
+    Same format as upsampling/utils/manifest.py, which lives in the other environment."""
+    filename = "manifest.jsonl"
+
+    def __init__(self, dirpath: str):
+        self.path = os.path.join(dirpath, self.filename)
+        self.entries = dict()
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partially written line of an interrupted run
+                    continue
+                self.entries[entry["sequence"]] = entry
+
+    def is_done(self, sequence: str, key: str = None) -> bool:
+        # with a key, the sequence only counts as done if it was produced from the same inputs and parameters
+        entry = self.entries.get(sequence, {})
+        return entry.get("status") == "done" and (key is None or entry.get("key") == key)
+
+    def get(self, sequence: str) -> dict:
+        return self.entries.get(sequence, {})
+
+    def update(self, sequence: str, status: str, **info):
+        entry = dict(sequence=sequence, status=status, **info)
+        self.entries[sequence] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def cache_key(filepaths, params: dict) -> str:
+    """Hash of the content of the input files and of the parameters that produced an artifact."""
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    for filepath in sorted(filepaths):
+        h.update(os.path.basename(filepath).encode())
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
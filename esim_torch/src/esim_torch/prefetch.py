@@ -0,0 +1,67 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class PrefetchLoader:
+    """
+    Loads batches of frames on a thread pool while the consumer simulates earlier batches.
+
+    - load_fn(item) returns one float32 frame of frame_shape, e.g. a decoded log image.
+    - at most queue_depth batches are loaded ahead, each into a fresh (optionally pinned) buffer,
+      since the simulator keeps a view of the last frame of a batch.
+    - num_starved / wait_time_s count the batches the consumer had to wait for.
+    """
+
+    def __init__(self, load_fn, items, batch_size: int, frame_shape, num_workers: int = 4,
+                 queue_depth: int = 2, pin_memory: bool = False):
+        self.load_fn = load_fn
+        self.batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+        self.frame_shape = tuple(frame_shape)
+        self.num_workers = max(1, int(num_workers))
+        self.queue_depth = max(1, int(queue_depth))
+        self.pin_memory = pin_memory
+
+        self.num_starved = 0
+        self.wait_time_s = 0.0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            batches = iter(self.batches)
+            pending = deque()
+            for batch in batches:
+                pending.append(self._submit(pool, batch))
+                if len(pending) == self.queue_depth:
+                    break
+
+            while pending:
+                buffer, futures = pending.popleft()
+
+                if not all(f.done() for f in futures):
+                    self.num_starved += 1
+                t_start = time.perf_counter()
+                for f in futures:
+                    f.result()
+                self.wait_time_s += time.perf_counter() - t_start
+
+                batch = next(batches, None)
+                if batch is not None:
+                    pending.append(self._submit(pool, batch))
+
+                yield buffer
+
+    def stats(self):
+        return "consumer waited for {}/{} batches ({:.2f}s)".format(self.num_starved, len(self), self.wait_time_s)
+
+    def _submit(self, pool, batch):
+        buffer = torch.empty((len(batch),) + self.frame_shape, dtype=torch.float32, pin_memory=self.pin_memory)
+        futures = [pool.submit(self._load_into, buffer, i, item) for i, item in enumerate(batch)]
+        return buffer, futures
+
+    def _load_into(self, buffer, i, item):
+        buffer[i] = torch.from_numpy(self.load_fn(item))
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import numpy as np
+import torch
+
+import esim_torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from generate_events import simulate
+
+
+class NoProgress:
+    def set_description(self, description):
+        pass
+
+    def update(self, n):
+        pass
+
+
+def generate_npz(log_images, timestamps_ns, outdir, batch_size, refractory_period_ns):
+    args = argparse.Namespace(contrast_threshold_negative=0.2,
+                              contrast_threshold_positive=0.2,
+                              refractory_period_ns=refractory_period_ns,
+                              device="cpu",
+                              output_format="npz")
+    batches = ((log_images[start:start+batch_size], timestamps_ns[start:start+batch_size])
+               for start in range(0, len(log_images), batch_size))
+    simulate(batches, outdir, NoProgress(), args)
+    return sorted(glob.glob(os.path.join(outdir, "*.npz")))
+
+
+if __name__ == "__main__":
+    print("Loading images")
+    image_files = sorted(glob.glob("../esim_py/tests/data/images/images/*.png"))
+    log_images = torch.from_numpy(np.stack([esim_torch.load_log_image(f) for f in image_files]))
+    timestamps_s = np.genfromtxt("../esim_py/tests/data/images/timestamps.txt")
+    timestamps_ns = (timestamps_s * 1e9).astype("int64")
+
+    for refractory_period_ns in [0, 1000000]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            print("Generating frames with batch size 1 and refractory period {}ns".format(refractory_period_ns))
+            reference = generate_npz(log_images, timestamps_ns, os.path.join(tmpdir, "1"), 1, refractory_period_ns)
+            assert len(reference) == len(image_files) - 1, "Expected one file per frame interval"
+
+            for batch_size in [2, 7, 64, len(image_files)]:
+                print("Generating frames with batch size {}".format(batch_size))
+                files = generate_npz(log_images, timestamps_ns, os.path.join(tmpdir, str(batch_size)), batch_size,
+                                     refractory_period_ns)
+                assert len(files) == len(reference), "Mismatch in number of frames"
+                for f_ref, f in zip(reference, files):
+                    events_ref, events = np.load(f_ref), np.load(f)
+                    for k in "xytp":
+                        assert np.array_equal(events_ref[k], events[k]), "Mismatch in {} of {}".format(k, os.path.basename(f))
+            print("Frames are identical for all batch sizes")
@@ -0,0 +1,72 @@
+import torch
+import numpy as np
+import glob
+import cv2
+
+import esim_torch
+from esim_torch import esim_cpu
+
+
+def generate(log_images, timestamps_ns, device, refractory_period_ns):
+    esim = esim_torch.ESIM(contrast_threshold_neg=0.2,
+                           contrast_threshold_pos=0.2,
+                           refractory_period_ns=refractory_period_ns)
+    events = esim.forward(log_images.to(device), timestamps_ns.to(device))
+    return {k: v.cpu() for k, v in events.items()}
+
+
+def generate_multi_config(log_images, timestamps_ns, device, configs):
+    # configs: list of (contrast_threshold_neg, contrast_threshold_pos, refractory_period_ns), simulated in one pass
+    esim = esim_torch.ESIM(contrast_threshold_neg=[c[0] for c in configs],
+                           contrast_threshold_pos=[c[1] for c in configs],
+                           refractory_period_ns=[c[2] for c in configs])
+    events = esim.forward(log_images.to(device), timestamps_ns.to(device))
+    return [{k: v.cpu() for k, v in config_events.items()} for config_events in events]
+
+
+if __name__ == "__main__":
+    print("Loading images")
+    image_files = sorted(glob.glob("../esim_py/tests/data/images/images/*.png"))
+    images = np.stack([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in image_files])
+    timestamps_s = np.genfromtxt("../esim_py/tests/data/images/timestamps.txt")
+    timestamps_ns = torch.from_numpy((timestamps_s * 1e9).astype("int64"))
+    log_images = torch.from_numpy(np.log(images.astype("float32") / 255 + 1e-4))
+
+    for refractory_period_ns in [0, 1e6]:
+        print("Generating events on the CPU with refractory period {}ns".format(refractory_period_ns))
+        events_cpu = generate(log_images, timestamps_ns, "cpu", refractory_period_ns)
+        print("Num events: {}".format(len(events_cpu['t'])))
+
+        if not torch.cuda.is_available():
+            print("CUDA not available, skipping comparison")
+            continue
+
+        print("Generating events on the GPU")
+        events_gpu = generate(log_images, timestamps_ns, "cuda:0", refractory_period_ns)
+        for k in "xytp":
+            assert torch.equal(events_cpu[k], events_gpu[k]), "Mismatch in {}".format(k)
+        print("CPU and GPU events are identical")
+
+    configs = [(0.2, 0.2, 0), (0.1, 0.3, 1e6), (0.5, 0.15, 1e5)]
+    devices = ["cpu", "cuda:0"] if torch.cuda.is_available() else ["cpu"]
+    for device in devices:
+        print("Generating events for {} configurations in one pass on {}".format(len(configs), device))
+        events_multi = generate_multi_config(log_images, timestamps_ns, device, configs)
+        for (ct_neg, ct_pos, refractory_period_ns), events in zip(configs, events_multi):
+            esim = esim_torch.ESIM(ct_neg, ct_pos, refractory_period_ns)
+            events_single = esim.forward(log_images.to(device), timestamps_ns.to(device))
+            for k in "xytp":
+                assert torch.equal(events[k], events_single[k].cpu()), "Mismatch in {}".format(k)
+        print("Events are identical to one simulator per configuration")
+
+    # a mostly static scene: only a corner of the images changes, which the CPU backend simulates sparsely
+    static_log_images = log_images[:1].repeat(len(log_images), 1, 1)
+    static_log_images[:, :40, :60] = log_images[:, :40, :60]
+    print("Generating events of a mostly static scene with the dense and the sparse CPU simulation")
+    events = {}
+    for name, max_active_fraction in [("dense", 0), ("sparse", 1)]:
+        esim_cpu.SPARSE_MAX_ACTIVE_FRACTION = max_active_fraction
+        events[name] = generate(static_log_images, timestamps_ns, "cpu", 0)
+    for k in "xytp":
+        assert torch.equal(events["dense"][k], events["sparse"][k]), "Mismatch in {}".format(k)
+    print("Dense and sparse events are identical")
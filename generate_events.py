@@ -1,11 +1,69 @@
 import os
 import subprocess
+import tempfile
+import time
 
 class GenerateEvents:
-    def __init__(self, device: int = 0):
+    def __init__(self, device: int = 0, cache: bool = True):
         self.device = device
+        # Reuse upsampled frames and events of earlier runs with the same inputs and parameters.
+        # Each stage keeps the cache keys in manifest.jsonl of its output directory.
+        self.cache = cache
 
     def upsample(self, input_dir: str, output_dir: str):
+        cmd, env = self._upsample_cmd(input_dir, output_dir)
+        if self.cache:
+            cmd += ["--resume"]
+        print(f"[INFO] Starting upsampling: {input_dir} -> {output_dir}")
+        subprocess.run(cmd, check=True, env=env)
+        print("[INFO] Upsampling finished.")
+
+    def generate_events(self, input_dir: str, output_dir: str,
+                        contrast_threshold_pos: float = 0.2,
+                        contrast_threshold_neg: float = 0.2,
+                        refractory_period_ns: int = 0):
+        cmd, env = self._generate_events_cmd(["--input_dir", input_dir], output_dir,
+                                             contrast_threshold_pos, contrast_threshold_neg, refractory_period_ns)
+        if self.cache:
+            cmd += ["--resume"]
+        print(f"[INFO] Starting event generation: {input_dir} -> {output_dir}")
+        subprocess.run(cmd, check=True, env=env)
+        print("[INFO] Event generation finished.")
+
+    def stream_events(self, input_dir: str, output_dir: str, upsample_output_dir: str = None,
+                      contrast_threshold_pos: float = 0.2,
+                      contrast_threshold_neg: float = 0.2,
+                      refractory_period_ns: int = 0):
+        # Upsampled frames are piped from the upsampling env into the event generation env through a named pipe,
+        # the frames are only written as images if upsample_output_dir is given.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fifo = os.path.join(tmp_dir, "frames.fifo")
+            os.mkfifo(fifo)
+
+            events_cmd, events_env = self._generate_events_cmd(["--input_stream", fifo], output_dir,
+                                                               contrast_threshold_pos, contrast_threshold_neg,
+                                                               refractory_period_ns)
+            upsample_cmd, upsample_env = self._upsample_cmd(input_dir, upsample_output_dir, stream=fifo)
+
+            print(f"[INFO] Starting streamed upsampling and event generation: {input_dir} -> {output_dir}")
+            processes = [subprocess.Popen(events_cmd, env=events_env),
+                         subprocess.Popen(upsample_cmd, env=upsample_env)]
+            self._wait_all(processes)
+        print("[INFO] Streamed event generation finished.")
+
+    def run_pipeline(self, video_input_dir: str, upsample_output_dir: str, events_output_dir: str,
+                     contrast_threshold_pos: float = 0.2, contrast_threshold_neg: float = 0.2,
+                     refractory_period_ns: int = 0, stream: bool = False):
+        if stream:
+            self.stream_events(video_input_dir, events_output_dir, upsample_output_dir,
+                               contrast_threshold_pos, contrast_threshold_neg, refractory_period_ns)
+        else:
+            self.upsample(video_input_dir, upsample_output_dir)
+            self.generate_events(upsample_output_dir, events_output_dir,
+                                 contrast_threshold_pos, contrast_threshold_neg, refractory_period_ns)
+        print("[INFO] Pipeline finished successfully.")
+
+    def _upsample_cmd(self, input_dir: str, output_dir: str = None, stream: str = None):
         env = os.environ.copy()
         env["CUDA_VISIBLE_DEVICES"] = str(self.device) if self.device >= 0 else ""
 
@@ -13,53 +71,65 @@ class GenerateEvents:
             "conda", "run", "-n", "vid2e", "--no-capture-output",
             "python", "upsampling/upsample.py",
             "--input_dir", input_dir,
-            "--output_dir", output_dir,
         ]
-        print(f"[INFO] Starting upsampling: {input_dir} -> {output_dir}")
-        subprocess.run(cmd, check=True, env=env)
-        print("[INFO] Upsampling finished.")
+        if output_dir is not None:
+            cmd += ["--output_dir", output_dir]
+        if stream is not None:
+            cmd += ["--stream", stream]
+        return cmd, env
 
-    def generate_events(self, input_dir: str, output_dir: str,
-                        contrast_threshold_pos: float = 0.2,
-                        contrast_threshold_neg: float = 0.2,
-                        refractory_period_ns: int = 0):
+    def _generate_events_cmd(self, input_args: list, output_dir: str,
+                             contrast_threshold_pos: float, contrast_threshold_neg: float,
+                             refractory_period_ns: int):
         cmd = [
             "conda", "run", "-n", "vid2e_torch", "--no-capture-output",
             "python", "esim_torch/scripts/generate_events.py",
-            "--input_dir", input_dir,
+        ] + input_args + [
             "--output_dir", output_dir,
             "--contrast_threshold_pos", str(contrast_threshold_pos),
             "--contrast_threshold_neg", str(contrast_threshold_neg),
             "--refractory_period_ns", str(refractory_period_ns),
+            "--device", "cuda" if self.device >= 0 else "cpu",
         ]
-        print(f"[INFO] Starting event generation: {input_dir} -> {output_dir}")
-        subprocess.run(cmd, check=True)
-        print("[INFO] Event generation finished.")
-
+        env = os.environ.copy()
+        env["CUDA_VISIBLE_DEVICES"] = str(self.device) if self.device >= 0 else ""
+        return cmd, env
 
-    def run_pipeline(self, video_input_dir: str, upsample_output_dir: str, events_output_dir: str,
-                     contrast_threshold_pos: float = 0.2, contrast_threshold_neg: float = 0.2,
-                     refractory_period_ns: int = 0):
-        self.upsample(video_input_dir, upsample_output_dir)
-        self.generate_events(upsample_output_dir, events_output_dir,
-                             contrast_threshold_pos, contrast_threshold_neg, refractory_period_ns)
-        print("[INFO] Pipeline finished successfully.")
+    @staticmethod
+    def _wait_all(processes: list):
+        # if one side of the pipe fails, the other one would block forever on the named pipe
+        while any(p.poll() is None for p in processes):
+            if any(p.returncode not in (None, 0) for p in processes):
+                for p in processes:
+                    if p.poll() is None:
+                        p.terminate()
+            time.sleep(0.5)
+        for p in processes:
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, p.args)
 
 def main():
     import argparse
 
     p = argparse.ArgumentParser()
     p.add_argument("--video_input_dir", required=True)
-    p.add_argument("--upsample_output_dir", required=True)
+    p.add_argument("--upsample_output_dir", default=None,
+                   help="Upsampled frames as images, optional with --stream")
     p.add_argument("--events_output_dir", required=True)
     p.add_argument("--device", type=int, default=0, help="GPU id, -1 for CPU")
     p.add_argument("--ct_pos", type=float, default=0.2)
     p.add_argument("--ct_neg", type=float, default=0.2)
     p.add_argument("--refractory_period_ns", type=int, default=0)
+    p.add_argument("--stream", action="store_true",
+                   help="Pipe the upsampled frames directly into the event generation instead of reading them back from disk")
+    p.add_argument("--no_cache", action="store_true",
+                   help="Recompute everything instead of reusing upsampled frames and events of earlier runs")
 
     args = p.parse_args()
+    if args.upsample_output_dir is None and not args.stream:
+        p.error("--upsample_output_dir is required unless --stream is set")
 
-    pipeline = GenerateEvents(device=args.device)
+    pipeline = GenerateEvents(device=args.device, cache=not args.no_cache)
     pipeline.run_pipeline(
         video_input_dir=args.video_input_dir,
         upsample_output_dir=args.upsample_output_dir,
@@ -67,6 +137,7 @@ def main():
         contrast_threshold_pos=args.ct_pos,
         contrast_threshold_neg=args.ct_neg,
         refractory_period_ns=args.refractory_period_ns,
+        stream=args.stream,
     )
 
 if __name__ == "__main__":
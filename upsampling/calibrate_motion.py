@@ -0,0 +1,97 @@
+import argparse
+import csv
+import os
+import time
+# Must be set before importing torch.
+from PIL import ImageFile
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
+
+import numpy as np
+from tqdm import tqdm
+
+from utils import get_motion_estimator_or_none, get_sequence_or_none, motion_estimators
+from utils.interpolator import Interpolator
+from utils.motion import num_bisections_from_flow
+
+
+def get_flags():
+    parser = argparse.ArgumentParser(description='Compares the number of bisections chosen by the cheap motion estimators with the one derived from the flow of the interpolation model.')
+    parser.add_argument("--input_dir", required=True, help='Path to input directory, same structure as for upsample.py.')
+    parser.add_argument("--estimators", nargs='+', default=list(motion_estimators), choices=list(motion_estimators))
+    parser.add_argument("--scales", nargs='+', type=float, default=[0.25, 0.5])
+    parser.add_argument("--max_pairs", type=int, default=None, help='Maximum number of frame pairs per sequence.')
+    parser.add_argument("--csv", default=None, help='Optional path of a csv file with the depths of every frame pair.')
+    return parser.parse_args()
+
+
+def film_num_bisections(interpolator: Interpolator, img0: np.ndarray, img1: np.ndarray) -> int:
+    dt = np.full(shape=(1,), fill_value=0.5, dtype=np.float32)
+    _, F_0_1, F_1_0 = interpolator.interpolate(img0[None], img1[None], dt)
+    flow_mag_max = max(((F_0_1 ** 2).sum(-1) ** .5).max(), ((F_1_0 ** 2).sum(-1) ** .5).max())
+    return num_bisections_from_flow(flow_mag_max)
+
+
+def num_frames(num_bisections: np.ndarray) -> int:
+    # interpolated frames per pair, the model path always keeps the first midpoint
+    return int((2 ** num_bisections - 1).sum())
+
+
+def main():
+    flags = get_flags()
+
+    path = os.path.join(os.path.dirname(__file__), "../pretrained_models/film_net/Style/saved_model")
+    interpolator = Interpolator(path, None)
+    estimators = {'{}@{}'.format(name, scale): get_motion_estimator_or_none(name, scale)
+                  for name in flags.estimators for scale in flags.scales}
+
+    rows = list()
+    times = {name: 0.0 for name in ['film'] + list(estimators)}
+    for src_absdirpath, dirnames, filenames in os.walk(flags.input_dir):
+        sequence = get_sequence_or_none(src_absdirpath)
+        if sequence is None:
+            continue
+        for pair_idx, (img_pair, _) in enumerate(tqdm(next(sequence), total=len(sequence), desc=src_absdirpath)):
+            if flags.max_pairs is not None and pair_idx >= flags.max_pairs:
+                break
+            row = {'sequence': os.path.relpath(src_absdirpath, flags.input_dir), 'pair': pair_idx}
+
+            t_start = time.perf_counter()
+            row['film'] = film_num_bisections(interpolator, *img_pair)
+            times['film'] += time.perf_counter() - t_start
+
+            for name, estimator in estimators.items():
+                t_start = time.perf_counter()
+                row[name] = estimator.num_bisections(*img_pair)
+                times[name] += time.perf_counter() - t_start
+            rows.append(row)
+
+    assert rows, 'No sequences found in {}'.format(flags.input_dir)
+
+    film = np.array([row['film'] for row in rows])
+    print('{} frame pairs, {} interpolated frames and {:.1f} ms per pair with film'.format(
+        len(rows), num_frames(np.maximum(film, 1)), 1e3 * times['film'] / len(rows)))
+    print('{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}{:>12}{:>10}'.format(
+        'estimator', 'exact', 'under', 'over', 'mae', 'static', 'frames', 'ms/pair'))
+    for name in estimators:
+        depth = np.array([row[name] for row in rows])
+        print('{:<16}{:>10.1%}{:>10.1%}{:>10.1%}{:>10.2f}{:>10.1%}{:>12}{:>10.2f}'.format(
+            name,
+            np.mean(depth == film),
+            np.mean(depth < film),
+            np.mean(depth > film),
+            np.mean(np.abs(depth - film)),
+            np.mean(depth == 0),
+            num_frames(depth),
+            1e3 * times[name] / len(rows)))
+    print('under: fewer bisections than film (motion above one pixel per frame), static: pairs without interpolation')
+
+    if flags.csv is not None:
+        with open(flags.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,22 +5,46 @@ from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
 
-from utils import Upsampler
+from utils import Upsampler, get_motion_estimator_or_none, motion_estimators
 
 
 def get_flags():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_dir", required=True, help='Path to input directory. See README.md for expected structure of the directory.')
-    parser.add_argument("--output_dir", required=True, help='Path to non-existing output directory. This script will generate the directory.')
+    parser.add_argument("--output_dir", default=None, help='Path to non-existing output directory. This script will generate the directory. Optional with --stream.')
+    parser.add_argument("--stream", default=None, help='Path of a file or named pipe the upsampled frames are streamed to, e.g. for esim_torch/scripts/generate_events.py --input_stream.')
+    parser.add_argument("--batch_size", type=int, default=8, help='Maximum number of frames interpolated per model call.')
+    parser.add_argument("--pairs_per_batch", type=int, default=4, help='Number of consecutive frame pairs whose midpoints are interpolated together.')
+    parser.add_argument("--motion_estimator", default='film', choices=['film'] + list(motion_estimators), help='How the number of bisections is chosen: from the flow of the interpolation model (film) or up front with a cheap optical flow estimate, which skips interpolation for static frame pairs. See calibrate_motion.py.')
+    parser.add_argument("--motion_scale", type=float, default=0.25, help='Downscaling factor of the frames for the cheap motion estimators.')
+    parser.add_argument("--num_processes", type=int, default=1, help='Number of sequences upsampled in parallel, each worker process loads its own model. Not supported with --stream.')
+    parser.add_argument("--devices", nargs='+', default=None, help='GPUs assigned round robin to the worker processes, e.g. --devices 0 1.')
+    parser.add_argument("--resume", action='store_true', help='Continue an interrupted run in an existing output directory, sequences marked done in its manifest.jsonl are skipped.')
     args = parser.parse_args()
+    if args.output_dir is None and args.stream is None:
+        parser.error('--output_dir is required unless frames are streamed with --stream')
+    if args.num_processes > 1 and args.stream is not None:
+        parser.error('--num_processes > 1 can not be combined with --stream')
     return args
 
 
 def main():
     flags = get_flags()
-
-    upsampler = Upsampler(input_dir=flags.input_dir, output_dir=flags.output_dir)
-    upsampler.upsample()
+    motion_estimator = get_motion_estimator_or_none(flags.motion_estimator, flags.motion_scale)
+
+    if flags.stream is None:
+        upsampler = Upsampler(input_dir=flags.input_dir, output_dir=flags.output_dir,
+                              batch_size=flags.batch_size, pairs_per_batch=flags.pairs_per_batch,
+                              motion_estimator=motion_estimator, num_processes=flags.num_processes,
+                              devices=flags.devices, resume=flags.resume)
+        upsampler.upsample()
+        return
+
+    with open(flags.stream, 'wb') as stream:
+        upsampler = Upsampler(input_dir=flags.input_dir, output_dir=flags.output_dir, stream=stream,
+                              batch_size=flags.batch_size, pairs_per_batch=flags.pairs_per_batch,
+                              motion_estimator=motion_estimator, resume=flags.resume)
+        upsampler.upsample()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
 from .dataset import Sequence
+from .motion import get_motion_estimator_or_none, motion_estimators
 from .upsampler import Upsampler
 from .utils import get_sequence_or_none
@@ -1,4 +1,6 @@
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Union
 
@@ -25,9 +27,11 @@ class Sequence:
 
 
 class ImageSequence(Sequence):
-    def __init__(self, imgs_dirpath: str, fps: float):
+    def __init__(self, imgs_dirpath: str, fps: float, num_prefetch: int = 4):
         super().__init__()
         self.fps = fps
+        # Number of frames decoded ahead of the consumer on a background thread.
+        self.num_prefetch = max(1, num_prefetch)
 
         assert os.path.isdir(imgs_dirpath)
         self.imgs_dirpath = imgs_dirpath
@@ -41,11 +45,20 @@ class ImageSequence(Sequence):
         return Path(path).suffix.lower() in img_formats
 
     def __next__(self):
-        for idx in range(0, len(self.file_names) - 1):
-            file_paths = self._get_path_from_name([self.file_names[idx], self.file_names[idx + 1]])
-            imgs = [self._pil_loader(f) for f in file_paths]
-            times_sec = [idx/self.fps, (idx + 1)/self.fps]
-            yield imgs, times_sec
+        # Sliding window: every frame is decoded once and is the second image of one pair and the first of the next,
+        # so consumers must not modify the images in place.
+        file_paths = self._get_path_from_name(self.file_names)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = deque(pool.submit(self._pil_loader, f) for f in file_paths[:self.num_prefetch + 1])
+            last_img = pending.popleft().result()
+            for idx in range(0, len(file_paths) - 1):
+                if idx + self.num_prefetch + 1 < len(file_paths):
+                    pending.append(pool.submit(self._pil_loader, file_paths[idx + self.num_prefetch + 1]))
+                img = pending.popleft().result()
+                imgs = [last_img, img]
+                times_sec = [idx/self.fps, (idx + 1)/self.fps]
+                yield imgs, times_sec
+                last_img = img
 
     def __len__(self):
         return len(self.file_names) - 1
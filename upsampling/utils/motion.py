@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+
+def num_bisections_from_flow(flow_mag_max: float) -> int:
+    # Number of bisections such that the motion between consecutive frames is at most about one pixel.
+    if flow_mag_max <= 1:
+        return 0
+    return int(np.ceil(np.log(flow_mag_max)/np.log(2)))
+
+
+class MotionEstimator:
+    """Estimates the maximum optical flow magnitude (in pixels) between two frames without running the
+    interpolation model, so that the number of bisections is known before interpolating."""
+
+    def __init__(self, scale: float = 0.25, percentile: float = 100):
+        assert 0 < scale <= 1, 'scale must be in (0, 1]'
+        self.scale = scale
+        self.percentile = percentile
+
+    def max_flow(self, img0: np.ndarray, img1: np.ndarray) -> float:
+        # img0, img1: (H, W, 3) float32 frames in [0, 1] as returned by the sequences.
+        gray0, gray1 = self._prepare(img0), self._prepare(img1)
+        flow = self._flow(gray0, gray1)
+        flow_mag = (flow ** 2).sum(-1) ** .5
+        return float(np.percentile(flow_mag, self.percentile)) / self.scale
+
+    def num_bisections(self, img0: np.ndarray, img1: np.ndarray) -> int:
+        return num_bisections_from_flow(self.max_flow(img0, img1))
+
+    def _prepare(self, img: np.ndarray):
+        gray = cv2.cvtColor(np.clip(img * 255, 0, 255).astype("uint8"), cv2.COLOR_RGB2GRAY)
+        if self.scale == 1:
+            return gray
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _flow(self, gray0: np.ndarray, gray1: np.ndarray):
+        raise NotImplementedError
+
+
+class FarnebackMotionEstimator(MotionEstimator):
+    def _flow(self, gray0: np.ndarray, gray1: np.ndarray):
+        return cv2.calcOpticalFlowFarneback(gray0, gray1, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+
+class DISMotionEstimator(MotionEstimator):
+    def __init__(self, scale: float = 0.25, percentile: float = 100):
+        super().__init__(scale, percentile)
+        # Created on first use, so that the estimator can be pickled for the worker processes of the upsampler.
+        self._dis = None
+
+    def _flow(self, gray0: np.ndarray, gray1: np.ndarray):
+        if self._dis is None:
+            self._dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_FAST)
+        return self._dis.calc(gray0, gray1, None)
+
+
+motion_estimators = {
+    'farneback': FarnebackMotionEstimator,
+    'dis': DISMotionEstimator,
+}
+
+
+def get_motion_estimator_or_none(name: str, scale: float = 0.25, percentile: float = 100):
+    # 'film' keeps deriving the number of bisections from the flow of the interpolation model itself.
+    if name == 'film':
+        return None
+    assert name in motion_estimators, 'Unknown motion estimator {}. Choose from film, {}'.format(name, ', '.join(motion_estimators))
+    return motion_estimators[name](scale, percentile)
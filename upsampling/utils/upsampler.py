@@ -1,5 +1,8 @@
+import io
+import multiprocessing
 import os
 import shutil
+import time
 
 import cv2
 import numpy as np
@@ -8,100 +11,272 @@ from tqdm import tqdm
 from . import Sequence
 from .const import imgs_dirname
 from .interpolator import Interpolator
+from .manifest import Manifest, cache_key
+from .motion import MotionEstimator, num_bisections_from_flow
 from .utils import get_sequence_or_none
 
 
 class Upsampler:
     _timestamps_filename = 'timestamps.txt'
+    _pretrained_models_dir = os.path.join(os.path.dirname(__file__), '../../pretrained_models')
+    _model_name = 'film_net/Style/saved_model'
 
-    def __init__(self, input_dir: str, output_dir: str):
+    def __init__(self, input_dir: str, output_dir: str = None, stream=None, batch_size: int = 8, pairs_per_batch: int = 4,
+                 motion_estimator: MotionEstimator = None, num_processes: int = 1, devices: list = None,
+                 resume: bool = False):
         assert os.path.isdir(input_dir), 'The input directory must exist'
-        assert not os.path.exists(output_dir), 'The output directory must not exist'
+        assert output_dir is not None or stream is not None, 'Either an output directory or a stream is required'
+        assert output_dir is None or resume or not os.path.exists(output_dir), 'The output directory must not exist'
+        assert num_processes == 1 or stream is None, 'Streamed sequences can not be processed in parallel'
+        assert not resume or output_dir is not None, 'Only runs with an output directory can be resumed'
 
-        self._prepare_output_dir(input_dir, output_dir)
+        if output_dir is not None:
+            self._prepare_output_dir(input_dir, output_dir)
         self.src_dir = input_dir
         self.dest_dir = output_dir
+        self.stream = stream
+        # Maximum number of frames per interpolation call and number of consecutive frame pairs upsampled together.
+        self.batch_size = batch_size
+        self.pairs_per_batch = pairs_per_batch
+        # Decides the number of bisections before interpolating. If None, it follows from the flow of the model.
+        self.motion_estimator = motion_estimator
+        # Sequences are distributed over num_processes workers, worker i uses devices[i % len(devices)].
+        self.num_processes = num_processes
+        self.devices = devices
+        self.resume = resume
 
-        path = os.path.join(os.path.dirname(__file__), "../../pretrained_models/film_net/Style/saved_model")
-        self.interpolator = Interpolator(path, None)
+        # With several processes every worker loads its own model, see _init_worker.
+        self.interpolator = self._load_interpolator() if num_processes == 1 else None
+
+    @classmethod
+    def _load_interpolator(cls):
+        return Interpolator(os.path.join(cls._pretrained_models_dir, cls._model_name), None)
+
+    def _cache_key(self, src_absdirpath: str):
+        # Upsampled frames depend on the input files of the sequence, the model and how bisections are chosen.
+        filepaths = [os.path.join(src_absdirpath, f) for f in os.listdir(src_absdirpath)]
+        imgs_dir = os.path.join(src_absdirpath, imgs_dirname)
+        if os.path.isdir(imgs_dir):
+            filepaths += [os.path.join(imgs_dir, f) for f in os.listdir(imgs_dir)]
+        filepaths = [f for f in filepaths if os.path.isfile(f)]
+        motion_estimator = None
+        if self.motion_estimator is not None:
+            motion_estimator = [type(self.motion_estimator).__name__, self.motion_estimator.scale,
+                                self.motion_estimator.percentile]
+        return cache_key(filepaths, dict(model=self._model_name, motion_estimator=motion_estimator))
+
+    def _is_cached(self, manifest: Manifest, reldirpath: str, key: str):
+        # Done with the same key and the frames are still complete on disk.
+        if not manifest.is_done(reldirpath, key):
+            return False
+        dest_imgs_dir = os.path.join(self.dest_dir, reldirpath, imgs_dirname)
+        if not os.path.isfile(os.path.join(self.dest_dir, reldirpath, self._timestamps_filename)):
+            return False
+        return os.path.isdir(dest_imgs_dir) and len(os.listdir(dest_imgs_dir)) == manifest.get(reldirpath)['num_frames']
 
     def upsample(self):
-        sequence_counter = 0
+        # Longest sequences first, so that a long sequence does not start last and delay the end of the run.
+        jobs = list()
         for src_absdirpath, dirnames, filenames in os.walk(self.src_dir):
             sequence = get_sequence_or_none(src_absdirpath)
             if sequence is None:
                 continue
-            sequence_counter += 1
-            print('Processing sequence number {}'.format(src_absdirpath))
-            reldirpath = os.path.relpath(src_absdirpath, self.src_dir)
-            dest_imgs_dir = os.path.join(self.dest_dir, reldirpath, imgs_dirname)
-            dest_timestamps_filepath = os.path.join(self.dest_dir, reldirpath, self._timestamps_filename)
-            self.upsample_sequence(sequence, dest_imgs_dir, dest_timestamps_filepath)
-
-    def upsample_sequence(self, sequence: Sequence, dest_imgs_dir: str, dest_timestamps_filepath: str):
-        os.makedirs(dest_imgs_dir, exist_ok=True)
+            jobs.append((src_absdirpath, len(sequence), None))
+        jobs.sort(key=lambda job: job[1], reverse=True)
+
+        manifest = Manifest(self.dest_dir) if self.dest_dir is not None else None
+        if manifest is not None and self.resume:
+            # Sequences upsampled before from the same inputs and parameters are reused. Otherwise every job computes
+            # its own key, hashing the inputs of all sequences here would delay the first job.
+            num_jobs = len(jobs)
+            jobs = [(src_absdirpath, num_frames, self._cache_key(src_absdirpath))
+                    for src_absdirpath, num_frames, _ in jobs]
+            jobs = [job for job in jobs if not self._is_cached(manifest, os.path.relpath(job[0], self.src_dir), job[2])]
+            print('Resuming: reusing {} upsampled sequences'.format(num_jobs - len(jobs)))
+        jobs = [(src_absdirpath, key) for src_absdirpath, _, key in jobs]
+
+        if self.num_processes == 1:
+            results = (self._upsample_job(*job) for job in jobs)
+            self._collect(results, manifest)
+            return
+
+        context = multiprocessing.get_context('spawn')
+        device_queue = context.Queue()
+        for i in range(self.num_processes):
+            device_queue.put(self.devices[i % len(self.devices)] if self.devices else None)
+        with context.Pool(self.num_processes, initializer=_init_worker, initargs=(self, device_queue)) as pool:
+            results = pool.imap_unordered(_run_job, jobs)
+            self._collect(results, manifest)
+
+    def _collect(self, results, manifest: Manifest):
+        failed = list()
+        for reldirpath, status, info in results:
+            if manifest is not None:
+                manifest.update(reldirpath, status, **info)
+            if status != 'done':
+                print('Upsampling {} failed: {}'.format(reldirpath, info['error']))
+                failed.append(reldirpath)
+        if failed:
+            raise RuntimeError('Upsampling failed for {} sequences: {}'.format(len(failed), ', '.join(failed)))
+
+    def _upsample_job(self, src_absdirpath: str, key: str = None):
+        reldirpath = os.path.relpath(src_absdirpath, self.src_dir)
+        print('Processing sequence number {}'.format(src_absdirpath))
+        t_start = time.time()
+        try:
+            if key is None and self.dest_dir is not None:
+                key = self._cache_key(src_absdirpath)
+            sequence = get_sequence_or_none(src_absdirpath)
+            dest_imgs_dir = None
+            dest_timestamps_filepath = None
+            if self.dest_dir is not None:
+                dest_imgs_dir = os.path.join(self.dest_dir, reldirpath, imgs_dirname)
+                dest_timestamps_filepath = os.path.join(self.dest_dir, reldirpath, self._timestamps_filename)
+                # frames of an interrupted run
+                shutil.rmtree(dest_imgs_dir, ignore_errors=True)
+            num_frames = self.upsample_sequence(sequence, dest_imgs_dir, dest_timestamps_filepath, stream_name=reldirpath)
+        except Exception as e:
+            return reldirpath, 'failed', dict(error=repr(e))
+        return reldirpath, 'done', dict(num_frames=num_frames, key=key, seconds=round(time.time() - t_start, 3))
+
+    def upsample_sequence(self, sequence: Sequence, dest_imgs_dir: str = None, dest_timestamps_filepath: str = None,
+                          stream_name: str = None):
+        # Frames go to the image directory and/or the stream, see _write_stream_array for the stream format.
+        if dest_imgs_dir is not None:
+            os.makedirs(dest_imgs_dir, exist_ok=True)
+        if self.stream is not None:
+            self._write_stream_array(np.array(stream_name))
+
         timestamps_list = list()
+        for idx, (frame, timestamp) in enumerate(self.iter_upsampled(sequence)):
+            img = self._to_gray_u8(frame)
+            if dest_imgs_dir is not None:
+                self._write_img(img, idx, dest_imgs_dir)
+            if self.stream is not None:
+                self._write_stream_array(np.array(timestamp, dtype=np.float64))
+                self._write_stream_array(img)
+            timestamps_list.append(timestamp)
+
+        if self.stream is not None:
+            self.stream.flush()
+        if dest_timestamps_filepath is not None:
+            self._write_timestamps(timestamps_list, dest_timestamps_filepath)
+        return len(timestamps_list)
 
-        idx = 0
+    def iter_upsampled(self, sequence: Sequence):
+        # Yields the upsampled frames (original + interpolated) with their timestamps in seconds.
+        pairs = list()
         for img_pair, time_pair in tqdm(next(sequence), total=len(sequence), desc=type(sequence).__name__):
-            I0 = img_pair[0][None]
-            I1 = img_pair[1][None]
-            t0, t1 = time_pair
+            pairs.append((img_pair[0][None], img_pair[1][None], time_pair[0], time_pair[1]))
+            if len(pairs) == self.pairs_per_batch:
+                yield from self._upsample_pairs(pairs)
+                pairs = list()
+        yield from self._upsample_pairs(pairs)
+
+        I1, t1 = img_pair[1], time_pair[1]
+        yield I1, t1
 
-            total_frames, total_timestamps = self._upsample_adaptive(I0, I1, t0, t1)
-            total_frames = [I0[0]] + total_frames
-            timestamps = [t0] + total_timestamps
+    def _upsample_pairs(self, pairs: list):
+        # Yields the first frame of each pair followed by its interpolated frames, sorted by time.
+        for (I0, _, t0, _), (images, timestamps) in zip(pairs, self._upsample_adaptive(pairs)):
+            total_frames = [I0[0]] + images
+            timestamps = [t0] + timestamps
 
             sorted_indices = np.argsort(timestamps)
-            total_frames = [total_frames[j] for j in sorted_indices]
-            timestamps = [timestamps[i] for i in sorted_indices]
+            for j in sorted_indices:
+                yield total_frames[j], timestamps[j]
 
-            timestamps_list += timestamps
-            for frame in total_frames:
-                self._write_img(frame, idx, dest_imgs_dir)
-                idx += 1
+    def _upsample_adaptive(self, pairs: list):
+        # Bisects every pair (I0, I1, t0, t1) breadth-first: the midpoints of one level are independent, so all of
+        # them, over all pairs, are interpolated together. The number of levels of a pair follows from the maximum
+        # flow magnitude, such that the motion between consecutive frames is about one pixel. Without a motion
+        # estimator it is taken from the flow of the model at the first midpoint, which is always kept.
+        results = [([], []) for _ in pairs]
+        num_levels = [None] * len(pairs)
+        if self.motion_estimator is not None:
+            num_levels = [self.motion_estimator.num_bisections(I0[0], I1[0]) for I0, I1, _, _ in pairs]
+        segments = [(k, I0, I1, t0, t1) for k, (I0, I1, t0, t1) in enumerate(pairs) if num_levels[k] != 0]
 
-        timestamps_list.append(t1)
-        self._write_img(I1[0, ...], idx, dest_imgs_dir)
-        self._write_timestamps(timestamps_list, dest_timestamps_filepath)
+        level = 0
+        while len(segments) > 0:
+            images, flow_mags = self._interpolate_midpoints([s[1] for s in segments], [s[2] for s in segments])
 
-    def _upsample_adaptive(self, I0, I1, t0, t1, num_bisections=-1):
-        if num_bisections == 0:
-            return [], []
+            next_segments = list()
+            for (k, I0, I1, t0, t1), image, flow_mag in zip(segments, images, flow_mags):
+                if num_levels[k] is None:
+                    num_levels[k] = max(num_bisections_from_flow(flow_mag), 1)
 
-        dt = self.batch_dt = np.full(shape=(1,), fill_value=0.5, dtype=np.float32)
-        image, F_0_1, F_1_0 = self.interpolator.interpolate(I0, I1, dt)
+                t_mid = (t0 + t1) / 2
+                results[k][0].append(image[0])
+                results[k][1].append(t_mid)
 
-        if num_bisections < 0:
-            flow_mag_0_1_max = ((F_0_1 ** 2).sum(-1) ** .5).max()
-            flow_mag_1_0_max = ((F_1_0 ** 2).sum(-1) ** .5).max()
-            num_bisections = int(np.ceil(np.log(max([flow_mag_0_1_max, flow_mag_1_0_max]))/np.log(2)))
+                if level + 1 < num_levels[k]:
+                    next_segments += [(k, I0, image, t0, t_mid), (k, image, I1, t_mid, t1)]
 
-            if num_bisections == 0:
-                return [image[0]], [(t0 + t1) / 2]
+            segments = next_segments
+            level += 1
 
-        left_images, left_timestamps = self._upsample_adaptive(I0, image, t0, (t0+t1)/2, num_bisections=num_bisections-1)
-        right_images, right_timestamps = self._upsample_adaptive(image, I1, (t0+t1)/2, t1, num_bisections=num_bisections-1)
-        timestamps = left_timestamps + [(t0+t1)/2] + right_timestamps
-        images = left_images + [image[0]] + right_images
+        return results
 
-        return images, timestamps
+    def _interpolate_midpoints(self, I0s: list, I1s: list):
+        # Interpolates the midpoints of all pairs in batches of at most batch_size.
+        # Returns the midpoints as (1, H, W, C) arrays and the maximum flow magnitude of each pair.
+        images, flow_mags = list(), list()
+        for i in range(0, len(I0s), self.batch_size):
+            x0 = np.concatenate(I0s[i:i + self.batch_size])
+            x1 = np.concatenate(I1s[i:i + self.batch_size])
+            dt = np.full(shape=(len(x0),), fill_value=0.5, dtype=np.float32)
+            image, F_0_1, F_1_0 = self.interpolator.interpolate(x0, x1, dt)
+
+            flow_mag_0_1_max = ((F_0_1 ** 2).sum(-1) ** .5).reshape(len(x0), -1).max(-1)
+            flow_mag_1_0_max = ((F_1_0 ** 2).sum(-1) ** .5).reshape(len(x0), -1).max(-1)
+            images += [image[j:j + 1] for j in range(len(x0))]
+            flow_mags += list(np.maximum(flow_mag_0_1_max, flow_mag_1_0_max))
+        return images, flow_mags
 
     def _prepare_output_dir(self, src_dir: str, dest_dir: str):
         # Copy directory structure.
         def ignore_files(directory, files):
             return [f for f in files if os.path.isfile(os.path.join(directory, f))]
-        shutil.copytree(src_dir, dest_dir, ignore=ignore_files)
+        shutil.copytree(src_dir, dest_dir, ignore=ignore_files, dirs_exist_ok=True)
+
+    @staticmethod
+    def _to_gray_u8(img: np.ndarray):
+        img = np.clip(img * 255, 0, 255).astype("uint8")
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     @staticmethod
     def _write_img(img: np.ndarray, idx: int, imgs_dir: str):
         assert os.path.isdir(imgs_dir)
-        img = np.clip(img * 255, 0, 255).astype("uint8")
         path = os.path.join(imgs_dir, "%08d.png" % idx)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         cv2.imwrite(path, img)
 
+    def _write_stream_array(self, array: np.ndarray):
+        # The stream is a sequence of .npy arrays: the sequence name (str) starts a sequence,
+        # then each frame is sent as its timestamp in seconds (float64) followed by the uint8 grayscale image.
+        # Arrays are serialized in memory first since np.save needs a seekable file.
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        self.stream.write(buffer.getbuffer())
+
     @staticmethod
     def _write_timestamps(timestamps: list, timestamps_filename: str):
         with open(timestamps_filename, 'w') as t_file:
-            t_file.writelines([str(t) + '\n' for t in timestamps])
\ No newline at end of file
+            t_file.writelines([str(t) + '\n' for t in timestamps])
+
+
+_worker_upsampler = None
+
+
+def _init_worker(upsampler: Upsampler, device_queue):
+    # Runs once per worker process: pins the worker to its device before the model is loaded.
+    global _worker_upsampler
+    device = device_queue.get()
+    if device is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(device)
+    upsampler.interpolator = upsampler._load_interpolator()
+    _worker_upsampler = upsampler
+
+
+def _run_job(job):
+    return _worker_upsampler._upsample_job(*job)
@@ -0,0 +1,101 @@
+import argparse
+import time
+
+import numpy as np
+
+from render_events import ACCUMULATE_METHODS, _FAST_UFUNC_AT, EventVideoRenderer, scatter_max
+
+
+def synthetic_burst(n, w, h, tau_ns, dt_ns, rng):
+    # events of one frame: half spread over the sensor, half in a small hotspot, so that many pixels repeat
+    n_hot = n // 2
+    x = np.concatenate([rng.integers(0, w, n - n_hot), rng.integers(w // 2, w // 2 + 16, n_hot)])
+    y = np.concatenate([rng.integers(0, h, n - n_hot), rng.integers(h // 2, h // 2 + 16, n_hot)])
+    p01 = rng.integers(0, 2, n)
+    t_ns = np.sort(rng.integers(0, dt_ns, n))
+    idx = p01 * (h * w) + y * w + x
+    values = np.exp(-(dt_ns - t_ns) / tau_ns).astype(np.float32)
+    return idx.astype(np.intp), values
+
+
+def timeit(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t_start)
+    return best
+
+
+def bench_accumulate(args):
+    rng = np.random.default_rng(0)
+    methods = [m for m in ACCUMULATE_METHODS if m != "auto"]
+    print("accumulate, {}x{} sensor, best of {} runs, numpy {} (auto uses {})".format(
+        args.sensor_w, args.sensor_h, args.repeats, np.__version__, "at" if _FAST_UFUNC_AT else "sort"))
+    print("{:>12}".format("events") + "".join("{:>12}".format(m + " [ms]") for m in methods))
+    for n in args.events:
+        idx, values = synthetic_burst(n, args.sensor_w, args.sensor_h, 30e6, 1e9 / 120, rng)
+        surfs = {m: np.zeros(2 * args.sensor_h * args.sensor_w, dtype=np.float32) for m in methods}
+        times = {m: timeit(lambda: scatter_max(surfs[m], idx, values, m), args.repeats) for m in methods}
+        assert all(np.array_equal(surfs[m], surfs[methods[0]]) for m in methods), "methods disagree"
+        print("{:>12}".format(n) + "".join("{:>12.2f}".format(1e3 * times[m]) for m in methods))
+
+
+def compose_float(r):
+    # per-pixel float composition, as EventVideoRenderer._compose_frame did before the color table
+    pos_u8 = np.clip(r.pos_surf * 255.0, 0, 255).astype(np.uint8)
+    neg_u8 = np.clip(r.neg_surf * 255.0, 0, 255).astype(np.uint8)
+
+    mpos = pos_u8.astype(np.float32) / 255.0
+    mneg = neg_u8.astype(np.float32) / 255.0
+
+    movl = np.minimum(mpos, mneg)
+    mpos = mpos - movl
+    mneg = mneg - movl
+
+    img = np.full((r.h, r.w, 3), r.background, dtype=np.float32)
+    img += mpos[..., None] * r.pos_bgr[None, None, :]
+    img += mneg[..., None] * r.neg_bgr[None, None, :]
+    img += movl[..., None] * r.ovl_bgr[None, None, :]
+
+    np.clip(img, 0, 255, out=img)
+    return img.astype(np.uint8)
+
+
+def bench_compose(args):
+    rng = np.random.default_rng(0)
+    print("compose, best of {} runs".format(args.repeats))
+    print("{:>12}{:>12}{:>12}".format("size", "float [ms]", "lut [ms]"))
+    for w, h in args.compose_sizes:
+        # composition does not touch the events, only the surfaces
+        r = EventVideoRenderer.__new__(EventVideoRenderer)
+        r.w, r.h, r.background, r._lut = w, h, 0, None
+        r.pos_bgr = np.array((255, 150, 4), dtype=np.float32)
+        r.neg_bgr = np.array((105, 91, 244), dtype=np.float32)
+        r.ovl_bgr = np.array((204, 0, 204), dtype=np.float32)
+        r.surf = (rng.random((2, h, w)) ** 4).astype(np.float32)
+
+        assert np.array_equal(compose_float(r), r._compose_frame()), "compositions disagree"
+        t_float = timeit(lambda: compose_float(r), args.repeats)
+        t_lut = timeit(r._compose_frame, args.repeats)
+        print("{:>12}{:>12.2f}{:>12.2f}".format("{}x{}".format(w, h), 1e3 * t_float, 1e3 * t_lut))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser("Micro-benchmarks of the event video renderer on synthetic data")
+    ap.add_argument("--sensor_w", type=int, default=640)
+    ap.add_argument("--sensor_h", type=int, default=360)
+    ap.add_argument("--events", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 3_000_000],
+                    help="Events per frame")
+    ap.add_argument("--compose_sizes", type=int, nargs=2, action="append", default=None, metavar=("W", "H"),
+                    help="Frame sizes of the composition benchmark, default 640x360 and 1920x1080")
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--only", choices=["accumulate", "compose"], default=None)
+    args = ap.parse_args()
+    if args.compose_sizes is None:
+        args.compose_sizes = [(640, 360), (1920, 1080)]
+
+    if args.only in (None, "accumulate"):
+        bench_accumulate(args)
+    if args.only in (None, "compose"):
+        bench_compose(args)
@@ -0,0 +1,196 @@
+from bisect import bisect_left
+from collections import OrderedDict
+
+import glob
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+
+EVENT_KEYS = ("x", "y", "t", "p")
+
+
+def _memmap_npz(path: str):
+    """
+    Memory-maps the arrays of an uncompressed .npz (np.savez) without reading them.
+    Returns None for compressed archives, which have to be loaded.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            # the data of a member starts after its local file header
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            key = info.filename[:-len(".npy")] if info.filename.endswith(".npy") else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[key] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[key] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                        order="F" if fortran_order else "C")
+    return arrays
+
+
+class EventReader:
+    """
+    Time-indexed, memory-mapped access to the events of one sequence.
+
+    - reads events.npy (esim_torch EventWriter) or one .npz per frame.
+    - a per-directory index (file -> t_min/t_max/count) is built once and stored in event_index.json,
+      it is rebuilt for files whose size or modification time changed.
+    - read(t_start_ns, t_end_ns) finds the files by binary search over the index and the events within a file by
+      binary search over its memory-mapped t, so only the bytes of the window are touched.
+    """
+
+    INDEX_FILENAME = "event_index.json"
+
+    def __init__(self, events_dir: str, max_open_files: int = 64):
+        self.events_dir = events_dir
+        self.files = self._find_event_files(events_dir)
+        if len(self.files) == 0:
+            raise FileNotFoundError("No events.npy or .npz files found in {}".format(events_dir))
+
+        self.max_open_files = int(max_open_files)
+        self._open = OrderedDict()
+
+        index = self._load_or_build_index()
+        nonempty = [i for i, entry in enumerate(index) if entry["count"] > 0]
+        if len(nonempty) == 0:
+            raise RuntimeError("No events in {}".format(events_dir))
+
+        # files are in chronological order, the index only covers files with events
+        self._file_ids = np.asarray(nonempty, dtype=np.int64)
+        self._t_min = np.asarray([index[i]["t_min"] for i in nonempty], dtype=np.int64)
+        self._t_max = np.asarray([index[i]["t_max"] for i in nonempty], dtype=np.int64)
+        self.num_events = int(sum(entry["count"] for entry in index))
+
+    def __getstate__(self):
+        # open memory maps are not sent to other processes, they are mapped again there
+        state = self.__dict__.copy()
+        state["_open"] = OrderedDict()
+        return state
+
+    @property
+    def t_min(self):
+        return int(self._t_min[0])
+
+    @property
+    def t_max(self):
+        return int(self._t_max[-1])
+
+    def read(self, t_start_ns: int, t_end_ns: int):
+        """Events with t_start_ns <= t < t_end_ns as (x, y, t, p), views into the files where possible."""
+        k0 = int(np.searchsorted(self._t_max, t_start_ns, side="left"))
+        k1 = int(np.searchsorted(self._t_min, t_end_ns, side="left"))
+
+        parts = []
+        for k in range(k0, k1):
+            arrays = self._arrays(int(self._file_ids[k]))
+            t = arrays["t"]
+            j0 = bisect_left(t, t_start_ns)
+            j1 = bisect_left(t, t_end_ns, lo=j0)
+            if j1 > j0:
+                parts.append(tuple(arrays[key][j0:j1] for key in EVENT_KEYS))
+
+        if len(parts) == 0:
+            return (
+                np.empty((0,), np.int32),
+                np.empty((0,), np.int32),
+                np.empty((0,), np.int64),
+                np.empty((0,), np.int8),
+            )
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate([part[i] for part in parts]) for i in range(len(EVENT_KEYS)))
+
+    # ---------- files ----------
+
+    @staticmethod
+    def _find_event_files(events_dir: str):
+        # one events.npy per sequence (esim_torch EventWriter) or one .npz per frame
+        store = os.path.join(events_dir, "events.npy")
+        if os.path.isfile(store):
+            return [store]
+        return sorted(glob.glob(os.path.join(events_dir, "*.npz")))
+
+    def _arrays(self, file_id: int):
+        # memory-mapped x, y, t, p of a file, the most recently used files stay open
+        if file_id in self._open:
+            self._open.move_to_end(file_id)
+            return self._open[file_id]
+
+        arrays = self._map_file(self.files[file_id])
+        self._open[file_id] = arrays
+        if len(self._open) > self.max_open_files:
+            self._open.popitem(last=False)
+        return arrays
+
+    @staticmethod
+    def _map_file(path: str):
+        if path.endswith(".npy"):
+            events = np.load(path, mmap_mode="r")
+            return {key: events[key] for key in EVENT_KEYS}
+
+        arrays = _memmap_npz(path)
+        if arrays is None:
+            z = np.load(path)
+            arrays = {key: z[key] for key in EVENT_KEYS}
+        return {key: arrays[key].reshape(-1) for key in EVENT_KEYS}
+
+    # ---------- index ----------
+
+    def _load_or_build_index(self):
+        index_path = os.path.join(self.events_dir, self.INDEX_FILENAME)
+        cached = {}
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, "r") as f:
+                    cached = {entry["name"]: entry for entry in json.load(f)["files"]}
+            except (ValueError, KeyError):
+                cached = {}
+
+        index = []
+        changed = False
+        for path in self.files:
+            stat = os.stat(path)
+            entry = cached.get(os.path.basename(path))
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = self._index_entry(path, stat)
+                changed = True
+            index.append(entry)
+
+        if changed or len(cached) != len(index):
+            self._save_index(index_path, index)
+        return index
+
+    def _index_entry(self, path: str, stat):
+        t = self._map_file(path)["t"]
+        entry = {"name": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                 "count": int(t.size), "t_min": None, "t_max": None}
+        if t.size > 0:
+            entry["t_min"], entry["t_max"] = int(t[0]), int(t[-1])
+        return entry
+
+    @staticmethod
+    def _save_index(index_path: str, index: list):
+        # the index is only a cache, read-only event directories are indexed again on every open
+        try:
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"files": index}, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass
@@ -1,11 +1,48 @@
 from typing import Optional, Tuple
 
 import os
-import glob
 import math
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
 import numpy as np
 import cv2
 
+from event_reader import EventReader
+from video_writer import add_writer_args, open_video_writer, writer_options
+
+
+# numpy >= 1.25 has a fast path for ufunc.at. Older versions (requirements.txt pins 1.19) apply it element by element,
+# where sorting by pixel and reducing each run of equal pixels with reduceat is much faster.
+_FAST_UFUNC_AT = np.lib.NumpyVersion(np.__version__) >= "1.25.0"
+
+ACCUMULATE_METHODS = ("auto", "sort", "at")
+
+
+def scatter_max(surf, idx, values, method: str = "auto"):
+    """
+    surf[idx] = max(surf[idx], values) for a flat surf and possibly repeated idx.
+
+    - "at": np.maximum.at
+    - "sort": sort by idx, reduce the runs of equal idx with np.maximum.reduceat, one write per pixel
+    - "auto": "at" if numpy has a fast ufunc.at, "sort" otherwise
+    """
+    if method == "auto":
+        method = "at" if _FAST_UFUNC_AT else "sort"
+    if method == "at":
+        np.maximum.at(surf, idx, values)
+        return
+    if method != "sort":
+        raise ValueError("Unknown accumulation method {}, choose from {}".format(method, ACCUMULATE_METHODS))
+
+    order = np.argsort(idx)
+    idx = idx[order]
+    starts = np.flatnonzero(np.concatenate(([True], idx[1:] != idx[:-1])))
+    run_max = np.maximum.reduceat(values[order], starts)
+    idx = idx[starts]
+    surf[idx] = np.maximum(surf[idx], run_max)
+
 
 class EventVideoRenderer:
     """
@@ -29,6 +66,10 @@ class EventVideoRenderer:
         pos_bgr: Tuple[int, int, int] = (255, 150, 4),     # blue-ish
         neg_bgr: Tuple[int, int, int] = (105, 91, 244),    # red-ish
         overlap_bgr: Tuple[int, int, int] = (204, 0, 204), # magenta
+        accumulate: str = "auto",
+        warmup_tau: float = 10.0,
+        backend: str = "cv2",
+        ffmpeg_options: Optional[dict] = None,
     ):
         self.events_dir = events_dir
         self.out_path = out_path
@@ -47,34 +88,68 @@ class EventVideoRenderer:
 
         self.background = int(background)
         self.codec = str(codec)
+        # see video_writer.open_video_writer, codec is the fourcc of the cv2 backend
+        self.backend = backend
+        self.ffmpeg_options = dict(ffmpeg_options or {})
 
         self.pos_bgr = np.array(pos_bgr, dtype=np.float32)
         self.neg_bgr = np.array(neg_bgr, dtype=np.float32)
         self.ovl_bgr = np.array(overlap_bgr, dtype=np.float32)
 
-        self.pos_surf = np.zeros((self.h, self.w), dtype=np.float32)
-        self.neg_surf = np.zeros((self.h, self.w), dtype=np.float32)
+        if accumulate not in ACCUMULATE_METHODS:
+            raise ValueError("accumulate must be one of {}".format(ACCUMULATE_METHODS))
+        self.accumulate = accumulate
 
-        self.files = sorted(glob.glob(os.path.join(events_dir, "*.npz")))
-        if len(self.files) == 0:
-            raise FileNotFoundError("No .npz files found in {}".format(events_dir))
+        # parallel shards replay the events of the last warmup_tau * tau before their first frame
+        if warmup_tau <= 0:
+            raise ValueError("warmup_tau must be > 0")
+        self.warmup_tau = float(warmup_tau)
 
-        self.frame_times_ns = self._read_timestamps_seconds_as_ns(timestamps_path)
+        # both polarities in one array, so that decay and accumulation handle them in one pass
+        self.surf = np.zeros((2, self.h, self.w), dtype=np.float32)
 
-        # streaming cursor
-        self.file_idx = 0
-        self.cur = self._load_npz(self.files[0])
-        self.ptr = 0
+        # color table and frame buffers, created on first use, see _compose_frame
+        self._lut = None
+
+        self.reader = EventReader(events_dir)
+        self.files = self.reader.files
+
+        self.frame_times_ns = self._read_timestamps_seconds_as_ns(timestamps_path)
 
         self.t0_ns, self.t1_ns = self._compute_render_range()
 
+    @property
+    def neg_surf(self):
+        return self.surf[0]
+
+    @property
+    def pos_surf(self):
+        return self.surf[1]
+
     # ---------- public ----------
 
-    def render(self, max_frames: Optional[int] = None):
+    def render(self, max_frames: Optional[int] = None, num_workers: int = 1):
+        start_frame, n_frames = self._frame_range(max_frames)
+
+        if num_workers > 1 and n_frames >= 2 * num_workers:
+            return self._render_parallel(start_frame, n_frames, num_workers)
+
         writer = self._open_writer()
+        for frame in self.frames(max_frames):
+            writer.write(frame)
+        writer.release()
+        return self.out_path
 
-        self._seek_to_time(self.t0_ns)
+    def frames(self, max_frames: Optional[int] = None):
+        """Yields the rendered frames in order, each one is overwritten by the next, copy it to keep it."""
+        start_frame, n_frames = self._frame_range(max_frames)
+        for i in range(n_frames):
+            self._render_frame(start_frame, i)
+            yield self._compose_frame()
+
+    # ---------- rendering loop ----------
 
+    def _frame_range(self, max_frames: Optional[int]):
         start_frame = self.t0_ns // self.dt_ns
         end_frame = (self.t1_ns + self.dt_ns - 1) // self.dt_ns
         n_frames = int(end_frame - start_frame)
@@ -82,40 +157,83 @@ class EventVideoRenderer:
         if max_frames is not None:
             n_frames = min(n_frames, int(max_frames))
 
-        for i in range(n_frames):
-            frame_start = (start_frame + i) * self.dt_ns
-            frame_end = frame_start + self.dt_ns
-
-            self._decay()
-
-            x, y, t_ns, p01 = self._pop_events_until(frame_end)
-            if t_ns.size != 0:
-                keep = (t_ns >= frame_start)
-                x, y, t_ns, p01 = x[keep], y[keep], t_ns[keep], p01[keep]
-
-            self._accumulate(x, y, t_ns, p01, frame_end)
+        # stop after the frame with the last event
+        n_frames = min(n_frames, max(1, int(self.reader.t_max // self.dt_ns - start_frame + 1)))
+        return int(start_frame), n_frames
+
+    def _render_frame(self, start_frame: int, i: int):
+        # updates the surfaces with the i-th frame
+        frame_start = (start_frame + i) * self.dt_ns
+        frame_end = frame_start + self.dt_ns
+
+        self._decay()
+
+        x, y, t_ns, p = self.reader.read(max(frame_start, self.t0_ns), frame_end)
+        self._accumulate(x, y, t_ns, self._p_to_01(p), frame_end)
+
+    def _render_frames(self, writer, start_frame: int, first: int, last: int):
+        # frames first..last-1, without a writer the frames only update the surfaces
+        for i in range(first, last):
+            self._render_frame(start_frame, i)
+            if writer is not None:
+                writer.write(self._compose_frame())
+
+    def _render_parallel(self, start_frame: int, n_frames: int, num_workers: int):
+        # The surfaces only depend on events of the last few tau, so every shard of frames can start from zero
+        # surfaces and replay the frames of the last warmup_tau * tau before its first frame. Events older than that
+        # contribute at most exp(-warmup_tau) to a surface.
+        bounds = np.linspace(0, n_frames, num_workers + 1).astype(int)
+        out_dir = os.path.dirname(os.path.abspath(self.out_path))
+        ext = os.path.splitext(self.out_path)[1] or ".mp4"
+
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+            shards = [(start_frame, int(first), int(last), os.path.join(tmp_dir, "shard_%03d%s" % (k, ext)))
+                      for k, (first, last) in enumerate(zip(bounds[:-1], bounds[1:]))]
+            with multiprocessing.Pool(num_workers) as pool:
+                paths = pool.starmap(self._render_shard, shards)
+            self._concat(paths, tmp_dir)
+        return self.out_path
 
-            frame = self._compose_frame()
-            writer.write(frame)
+    def _render_shard(self, start_frame: int, first: int, last: int, path: str):
+        self.surf[:] = 0
+        warmup_frames = int(math.ceil(self.warmup_tau * self.tau_ns / self.dt_ns))
+        self._render_frames(None, start_frame, max(0, first - warmup_frames), first)
 
-            if self.file_idx >= len(self.files):
-                break
+        writer = self._open_writer(path)
+        self._render_frames(writer, start_frame, first, last)
+        writer.release()
+        return path
+
+    def _concat(self, paths, tmp_dir: str):
+        if shutil.which("ffmpeg") is not None:
+            list_path = os.path.join(tmp_dir, "shards.txt")
+            with open(list_path, "w") as f:
+                f.writelines("file '{}'\n".format(path) for path in paths)
+            subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                            "-c", "copy", self.out_path], check=True)
+            return
 
+        # without ffmpeg the shards are decoded and encoded once more
+        writer = self._open_writer()
+        for path in paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                writer.write(frame)
+            cap.release()
         writer.release()
-        return self.out_path
 
     # ---------- setup helpers ----------
 
-    def _open_writer(self):
-        fourcc = cv2.VideoWriter_fourcc(*self.codec)
-        writer = cv2.VideoWriter(self.out_path, fourcc, self.fps, (self.w, self.h))
-        if not writer.isOpened():
-            raise RuntimeError("Could not open VideoWriter (codec/path issue).")
-        return writer
+    def _open_writer(self, path: Optional[str] = None):
+        return open_video_writer(path or self.out_path, self.fps, (self.w, self.h),
+                                 backend=self.backend, codec=self.codec, **self.ffmpeg_options)
 
     def _compute_render_range(self):
         # event range (ns)
-        t0e, t1e = self._event_range_ns(self.files[0], self.files[-1])
+        t0e, t1e = self.reader.t_min, self.reader.t_max
 
         # if timestamps exist, prefer them
         if self.frame_times_ns is not None and self.frame_times_ns.size >= 2:
@@ -155,86 +273,11 @@ class EventVideoRenderer:
         p = np.asarray(p).reshape(-1)
         return (p > 0).astype(np.int8)
 
-    def _load_npz(self, path: str):
-        z = np.load(path)
-        x = np.asarray(z["x"]).reshape(-1).astype(np.int32)
-        y = np.asarray(z["y"]).reshape(-1).astype(np.int32)
-        t = np.asarray(z["t"]).reshape(-1).astype(np.int64)   # ns
-        p01 = self._p_to_01(z["p"])
-        return {"x": x, "y": y, "t": t, "p": p01}
-
-    @staticmethod
-    def _event_range_ns(first_file: str, last_file: str):
-        z0 = np.load(first_file)
-        z1 = np.load(last_file)
-        t0 = np.asarray(z0["t"]).reshape(-1)
-        t1 = np.asarray(z1["t"]).reshape(-1)
-        if t0.size == 0 or t1.size == 0:
-            raise RuntimeError("Empty t arrays in event files.")
-        return int(t0[0]), int(t1[-1])
-
-    # ---------- streaming ----------
-
-    def _seek_to_time(self, t0_ns: int):
-        self.file_idx = 0
-        self.cur = self._load_npz(self.files[0])
-        self.ptr = int(np.searchsorted(self.cur["t"], t0_ns, side="left"))
-
-        # if t0 is beyond the first file, walk forward
-        while self.ptr >= self.cur["t"].size:
-            self.file_idx += 1
-            if self.file_idx >= len(self.files):
-                return
-            self.cur = self._load_npz(self.files[self.file_idx])
-            self.ptr = int(np.searchsorted(self.cur["t"], t0_ns, side="left"))
-
-    def _pop_events_until(self, t_end_ns: int):
-        xs, ys, ts, ps = [], [], [], []
-
-        while True:
-            if self.file_idx >= len(self.files):
-                break
-
-            if self.ptr >= self.cur["t"].size:
-                self.file_idx += 1
-                if self.file_idx >= len(self.files):
-                    break
-                self.cur = self._load_npz(self.files[self.file_idx])
-                self.ptr = 0
-                continue
-
-            t_arr = self.cur["t"]
-            j = int(np.searchsorted(t_arr, t_end_ns, side="left"))
-            if j <= self.ptr:
-                break
-
-            xs.append(self.cur["x"][self.ptr:j])
-            ys.append(self.cur["y"][self.ptr:j])
-            ts.append(t_arr[self.ptr:j])
-            ps.append(self.cur["p"][self.ptr:j])
-            self.ptr = j
-
-        if len(xs) == 0:
-            return (
-                np.empty((0,), np.int32),
-                np.empty((0,), np.int32),
-                np.empty((0,), np.int64),
-                np.empty((0,), np.int8),
-            )
-
-        return (
-            np.concatenate(xs),
-            np.concatenate(ys),
-            np.concatenate(ts).astype(np.int64),
-            np.concatenate(ps).astype(np.int8),
-        )
-
     # ---------- math / rendering ----------
 
     def _decay(self):
         a = math.exp(-float(self.dt_ns) / float(self.tau_ns))
-        self.pos_surf *= a
-        self.neg_surf *= a
+        self.surf *= a
 
     def _accumulate(self, x, y, t_ns, p01, frame_end_ns: int):
         if x.size == 0:
@@ -252,33 +295,50 @@ class EventVideoRenderer:
         age = (frame_end_ns - t_ns).astype(np.float64)
         w = np.exp(-age / float(self.tau_ns)).astype(np.float32)
 
-        pos = (p01 == 1)
-        if np.any(pos):
-            np.maximum.at(self.pos_surf, (y[pos], x[pos]), w[pos])
-
-        neg = ~pos
-        if np.any(neg):
-            np.maximum.at(self.neg_surf, (y[neg], x[neg]), w[neg])
+        # linear index into surf, polarity selects the plane
+        idx = (p01 == 1).astype(np.intp) * (self.h * self.w) + y.astype(np.intp) * self.w + x
+        scatter_max(self.surf.reshape(-1), idx, w, self.accumulate)
 
     def _compose_frame(self):
-        pos_u8 = np.clip(self.pos_surf * 255.0, 0, 255).astype(np.uint8)
-        neg_u8 = np.clip(self.neg_surf * 255.0, 0, 255).astype(np.uint8)
-
-        mpos = pos_u8.astype(np.float32) / 255.0
-        mneg = neg_u8.astype(np.float32) / 255.0
+        # Both surfaces are quantized to 8 bit, so the color of a pixel only depends on the pair (pos_u8, neg_u8) and
+        # is looked up in a 256 x 256 table. All buffers are reused, the returned frame is overwritten by the next call.
+        if self._lut is None:
+            self._lut = self._color_lut()
+            self._scratch = np.empty((2, self.h, self.w), dtype=np.float32)
+            self._surf_u8 = np.empty((2, self.h, self.w), dtype=np.uint8)
+            self._lut_idx = np.empty((self.h, self.w), dtype=np.uint16)
+            self._frame = np.empty((self.h, self.w, 3), dtype=np.uint8)
+
+        np.multiply(self.surf, 255.0, out=self._scratch)
+        np.clip(self._scratch, 0, 255, out=self._scratch)
+        np.copyto(self._surf_u8, self._scratch, casting="unsafe")
+
+        # index = pos_u8 * 256 + neg_u8
+        np.copyto(self._lut_idx, self._surf_u8[1])
+        self._lut_idx <<= 8
+        self._lut_idx |= self._surf_u8[0]
+
+        np.take(self._lut, self._lut_idx, axis=0, out=self._frame)
+        return self._frame
+
+    def _color_lut(self):
+        # colors of all (pos_u8, neg_u8) pairs, computed with the same float32 operations as per-pixel composition
+        pos_u8, neg_u8 = np.divmod(np.arange(256 * 256), 256)
+
+        mpos = pos_u8.astype(np.uint8).astype(np.float32) / 255.0
+        mneg = neg_u8.astype(np.uint8).astype(np.float32) / 255.0
 
         movl = np.minimum(mpos, mneg)
         mpos = mpos - movl
         mneg = mneg - movl
 
-        img = np.full((self.h, self.w, 3), self.background, dtype=np.float32)
-        img += mpos[..., None] * self.pos_bgr[None, None, :]
-        img += mneg[..., None] * self.neg_bgr[None, None, :]
-        img += movl[..., None] * self.ovl_bgr[None, None, :]
-
-        np.clip(img, 0, 255, out=img)
-        return img.astype(np.uint8)
+        lut = np.full((256 * 256, 3), self.background, dtype=np.float32)
+        lut += mpos[:, None] * self.pos_bgr[None, :]
+        lut += mneg[:, None] * self.neg_bgr[None, :]
+        lut += movl[:, None] * self.ovl_bgr[None, :]
 
+        np.clip(lut, 0, 255, out=lut)
+        return lut.astype(np.uint8)
 
 def main():
     import argparse
@@ -292,6 +352,13 @@ def main():
     ap.add_argument("--fps", type=float, default=120.0)
     ap.add_argument("--tau_ms", type=float, default=30.0)
     ap.add_argument("--max_frames", type=int, default=None)
+    ap.add_argument("--accumulate", choices=ACCUMULATE_METHODS, default="auto",
+                    help="How events are max-accumulated into the surfaces, see benchmark_render.py")
+    add_writer_args(ap)
+    ap.add_argument("--num_workers", type=int, default=1,
+                    help="Render time shards of the video in parallel processes")
+    ap.add_argument("--warmup_tau", type=float, default=10.0,
+                    help="Every shard replays the events of the last warmup_tau * tau_ms before its first frame")
     args = ap.parse_args()
 
     r = EventVideoRenderer(
@@ -301,8 +368,13 @@ def main():
         timestamps_path=args.timestamps,
         fps=args.fps,
         tau_ms=args.tau_ms,
+        accumulate=args.accumulate,
+        warmup_tau=args.warmup_tau,
+        codec=args.codec,
+        backend=args.backend,
+        ffmpeg_options=writer_options(args),
     )
-    r.render(max_frames=args.max_frames)
+    r.render(max_frames=args.max_frames, num_workers=args.num_workers)
 
 
 if __name__ == "__main__":
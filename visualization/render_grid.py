@@ -0,0 +1,77 @@
+import argparse
+import os
+
+from render_events import ACCUMULATE_METHODS, EventVideoRenderer
+from side_by_side import OUT_H, OUT_W, FrameSource, VideoSource, compose_grid
+from video_writer import add_writer_args, open_video_writer, writer_options
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Composes videos and event renders into one grid video, "
+                                             "e.g. the original video next to the events of several contrast thresholds.")
+
+    # tiles, videos first, then one events render per directory
+    ap.add_argument("--videos", nargs="*", default=[], help="Video files, e.g. the original video")
+    ap.add_argument("--events_dirs", nargs="*", default=[], help="Event directories, each rendered into its own tile")
+    ap.add_argument("--labels", nargs="*", default=None,
+                    help="Text drawn on each tile, in the order videos then events_dirs. "
+                         "Defaults to the names of the files and directories")
+    ap.add_argument("--no_labels", action="store_true")
+    ap.add_argument("--timestamps", default=None)
+
+    # event render settings, shared by all event tiles
+    ap.add_argument("--sensor_w", type=int, default=320)
+    ap.add_argument("--sensor_h", type=int, default=256)
+    ap.add_argument("--fps", type=float, default=120.0)
+    ap.add_argument("--tau_ms", type=float, default=30.0)
+    ap.add_argument("--max_frames", type=int, default=None)
+    ap.add_argument("--accumulate", choices=ACCUMULATE_METHODS, default="auto")
+
+    # grid settings
+    ap.add_argument("--out", required=True, help="Output (1920x1080) video")
+    ap.add_argument("--rows", type=int, default=None)
+    ap.add_argument("--cols", type=int, default=None)
+    ap.add_argument("--gap", type=int, default=15)
+    ap.add_argument("--bg", type=int, default=0)
+    ap.add_argument("--fps_out", type=float, default=None)
+    ap.add_argument("--end_mode", choices=["min", "hold"], default="min")
+    add_writer_args(ap)
+
+    args = ap.parse_args()
+    num_tiles = len(args.videos) + len(args.events_dirs)
+    if num_tiles == 0:
+        ap.error("Give at least one of --videos and --events_dirs")
+    if args.labels is not None and len(args.labels) != num_tiles:
+        ap.error("Expected {} labels, got {}".format(num_tiles, len(args.labels)))
+
+    sources = [VideoSource(path) for path in args.videos]
+    for events_dir in args.events_dirs:
+        renderer = EventVideoRenderer(
+            events_dir=events_dir,
+            out_path=None,
+            sensor_size=(args.sensor_w, args.sensor_h),
+            timestamps_path=args.timestamps,
+            fps=args.fps,
+            tau_ms=args.tau_ms,
+            accumulate=args.accumulate,
+        )
+        sources.append(FrameSource(renderer.frames(max_frames=args.max_frames), renderer.fps, (renderer.w, renderer.h)))
+
+    labels = args.labels
+    if labels is None and not args.no_labels:
+        labels = [os.path.basename(os.path.normpath(path)) for path in args.videos + args.events_dirs]
+    fps_out = args.fps_out if args.fps_out is not None else max(source.fps for source in sources)
+
+    writer = open_video_writer(args.out, fps_out, (OUT_W, OUT_H), backend=args.backend, codec=args.codec,
+                               **writer_options(args))
+    try:
+        compose_grid(sources, writer, rows=args.rows, cols=args.cols, gap=args.gap, bg=args.bg, fps_out=fps_out,
+                     end_mode=args.end_mode, labels=labels)
+    finally:
+        for source in sources:
+            source.release()
+        writer.release()
+
+
+if __name__ == "__main__":
+    main()
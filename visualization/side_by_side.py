@@ -1,7 +1,12 @@
 import argparse
+import queue
+import threading
+
 import cv2
 import numpy as np
 
+from video_writer import add_writer_args, open_video_writer, writer_options
+
 OUT_W = 1920
 OUT_H = 1080
 
@@ -26,23 +31,41 @@ def get_fps(cap, name):
     return fps
 
 
-def compute_layout(in_w, in_h, gap):
-    max_w_each = (OUT_W - gap) / 2.0
-    max_h = OUT_H
+def grid_shape(n, rows=None, cols=None):
+    # rows x cols cells for n tiles, as square as possible if neither is given
+    if rows is None and cols is None:
+        cols = int(np.ceil(np.sqrt(n)))
+    if cols is None:
+        cols = int(np.ceil(n / float(rows)))
+    if rows is None:
+        rows = int(np.ceil(n / float(cols)))
+    if rows * cols < n:
+        raise ValueError("A {}x{} grid has no room for {} videos.".format(rows, cols, n))
+    return rows, cols
 
-    scale_w = max_w_each / float(in_w)
-    scale_h = max_h / float(in_h)
-    scale = min(scale_w, scale_h, 1.0)  # never upscale
 
-    rw = int(round(in_w * scale))
-    rh = int(round(in_h * scale))
+def compute_grid_layout(sizes, rows, cols, gap):
+    # Tile k goes to row k // cols and column k % cols. Every tile is scaled to fit its cell (never upscaled),
+    # the cells are as large as the largest scaled tile and the whole grid is centered on the output.
+    max_w_each = (OUT_W - (cols - 1) * gap) / float(cols)
+    max_h_each = (OUT_H - (rows - 1) * gap) / float(rows)
 
-    total_w = 2 * rw + gap
-    x_left = int((OUT_W - total_w) / 2)
-    x_right = x_left + rw + gap
-    y_top = int((OUT_H - rh) / 2)
+    scaled = []
+    for in_w, in_h in sizes:
+        scale = min(max_w_each / float(in_w), max_h_each / float(in_h), 1.0)
+        scaled.append((scale, int(round(in_w * scale)), int(round(in_h * scale))))
 
-    return scale, rw, rh, x_left, x_right, y_top
+    cell_w = max(rw for _, rw, _ in scaled)
+    cell_h = max(rh for _, _, rh in scaled)
+    x_left = int((OUT_W - (cols * cell_w + (cols - 1) * gap)) / 2)
+    y_top = int((OUT_H - (rows * cell_h + (rows - 1) * gap)) / 2)
+
+    tiles = []
+    for k, (scale, rw, rh) in enumerate(scaled):
+        x = x_left + (k % cols) * (cell_w + gap) + (cell_w - rw) // 2
+        y = y_top + (k // cols) * (cell_h + gap) + (cell_h - rh) // 2
+        tiles.append((scale, rw, rh, x, y))
+    return tiles
 
 
 def read_next(cap):
@@ -52,93 +75,173 @@ def read_next(cap):
     return frame
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--video1", required=True)
-    ap.add_argument("--video2", required=True)
-    ap.add_argument("--out", required=True)
-    ap.add_argument("--gap", type=int, default=15)
-    ap.add_argument("--bg", type=int, default=0)
-    ap.add_argument("--codec", default="mp4v")
-    ap.add_argument("--fps_out", type=float, default=None)
-    ap.add_argument("--end_mode", choices=["min", "hold"], default="min")
-    args = ap.parse_args()
+class VideoSource:
+    """Frames of a video file."""
 
-    cap1 = open_video(args.video1)
-    cap2 = open_video(args.video2)
+    def __init__(self, path, name=None):
+        self.cap = open_video(path)
+        self.w, self.h = get_size(self.cap)
+        self.fps = get_fps(self.cap, name or path)
 
-    w1, h1 = get_size(cap1)
-    w2, h2 = get_size(cap2)
-    if (w1 != w2) or (h1 != h2):
-        raise ValueError("Both videos must have the same size (got {}x{} and {}x{}).".format(w1, h1, w2, h2))
+    def read(self):
+        return read_next(self.cap)
 
-    fps1 = get_fps(cap1, "video1")
-    fps2 = get_fps(cap2, "video2")
-    fps_out = args.fps_out if args.fps_out is not None else max(fps1, fps2)
+    def release(self):
+        self.cap.release()
 
-    scale, rw, rh, x_left, x_right, y_top = compute_layout(w1, h1, args.gap)
-    interp = cv2.INTER_AREA
 
-    fourcc = cv2.VideoWriter_fourcc(*args.codec)
-    writer = cv2.VideoWriter(args.out, fourcc, fps_out, (OUT_W, OUT_H))
-    if not writer.isOpened():
-        raise RuntimeError("Could not open VideoWriter: {}".format(args.out))
+class FrameSource:
+    """Frames of an iterable at a constant fps, e.g. EventVideoRenderer.frames()."""
 
-    frame1 = read_next(cap1)
-    frame2 = read_next(cap2)
-    if frame1 is None or frame2 is None:
-        raise RuntimeError("Could not read first frame from both videos.")
+    def __init__(self, frames, fps, size):
+        self.frames = iter(frames)
+        self.fps = float(fps)
+        self.w, self.h = int(size[0]), int(size[1])
 
-    idx1 = 0
-    idx2 = 0
-    ended1 = False
-    ended2 = False
-    out_idx = 0
+    def read(self):
+        frame = next(self.frames, None)
+        # the renderer reuses its frame buffer, while the reader thread runs ahead
+        return None if frame is None else frame.copy()
 
-    while True:
-        t = out_idx / float(fps_out)
+    def release(self):
+        if hasattr(self.frames, "close"):
+            self.frames.close()
 
-        want1 = int(t * fps1)
-        want2 = int(t * fps2)
 
-        while (not ended1) and (idx1 < want1):
-            f = read_next(cap1)
-            if f is None:
-                ended1 = True
-                break
-            frame1 = f
-            idx1 += 1
+class ReaderThread:
+    """
+    Reads the frames of a source on a background thread, up to queue_size frames ahead.
+    frame_at(i) returns the i-th frame, or the last one once the source ended (then ended is True).
+    """
 
-        while (not ended2) and (idx2 < want2):
-            f = read_next(cap2)
-            if f is None:
-                ended2 = True
-                break
-            frame2 = f
-            idx2 += 1
+    def __init__(self, source, queue_size=8):
+        self.source = source
+        self.index = -1
+        self.frame = None
+        self.ended = False
 
-        if args.end_mode == "min":
-            if ended1 or ended2:
-                break
-        else:
-            if ended1 and ended2:
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def frame_at(self, index):
+        while (not self.ended) and (self.index < index):
+            frame = self._queue.get()
+            if frame is None:
+                self.ended = True
+                if self._error is not None:
+                    raise RuntimeError("Reading frames failed") from self._error
                 break
+            self.frame = frame
+            self.index += 1
+        return self.frame
+
+    def close(self):
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                frame = self.source.read()
+                if frame is None:
+                    break
+                self._queue.put(frame)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._queue.put(None)
+
+
+def compose(source1, source2, writer, gap=15, bg=0, fps_out=None, end_mode="min"):
+    if (source1.w != source2.w) or (source1.h != source2.h):
+        raise ValueError("Both videos must have the same size (got {}x{} and {}x{}).".format(
+            source1.w, source1.h, source2.w, source2.h))
+    compose_grid([source1, source2], writer, rows=1, cols=2, gap=gap, bg=bg, fps_out=fps_out, end_mode=end_mode)
+
+
+def compose_grid(sources, writer, rows=None, cols=None, gap=15, bg=0, fps_out=None, end_mode="min", labels=None):
+    rows, cols = grid_shape(len(sources), rows, cols)
+    if fps_out is None:
+        fps_out = max(source.fps for source in sources)
+
+    tiles = compute_grid_layout([(source.w, source.h) for source in sources], rows, cols, gap)
+    interp = cv2.INTER_AREA
+
+    # One canvas for all output frames. A tile is only resized and copied into it when its source frame changed,
+    # e.g. not while it is held at its last frame or when its fps is lower than fps_out.
+    canvas = np.full((OUT_H, OUT_W, 3), int(bg), dtype=np.uint8)
+    regions = [canvas[y:y + rh, x:x + rw] for _, rw, rh, x, y in tiles]
+    shown = [-1] * len(sources)
+
+    # all sources are decoded (or rendered) concurrently
+    readers = [ReaderThread(source) for source in sources]
+    try:
+        if any(reader.frame_at(0) is None for reader in readers):
+            raise RuntimeError("Could not read first frame from all videos.")
+
+        out_idx = 0
+        while True:
+            t = out_idx / float(fps_out)
+
+            for reader, source in zip(readers, sources):
+                reader.frame_at(int(t * source.fps))
+
+            if end_mode == "min":
+                if any(reader.ended for reader in readers):
+                    break
+            else:
+                if all(reader.ended for reader in readers):
+                    break
+
+            for k, (reader, (scale, rw, rh, _, _)) in enumerate(zip(readers, tiles)):
+                if shown[k] == reader.index:
+                    continue
+                if scale != 1.0:
+                    cv2.resize(reader.frame, (rw, rh), dst=regions[k], interpolation=interp)
+                else:
+                    regions[k][:] = reader.frame
+                if labels is not None and labels[k]:
+                    cv2.putText(regions[k], labels[k], (8, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2,
+                                cv2.LINE_AA)
+                shown[k] = reader.index
+
+            writer.write(canvas)
+            out_idx += 1
+    finally:
+        for reader in readers:
+            reader.close()
 
-        left = frame1
-        right = frame2
-        if scale != 1.0:
-            left = cv2.resize(left, (rw, rh), interpolation=interp)
-            right = cv2.resize(right, (rw, rh), interpolation=interp)
 
-        canvas = np.full((OUT_H, OUT_W, 3), int(args.bg), dtype=np.uint8)
-        canvas[y_top:y_top + rh, x_left:x_left + rw] = left
-        canvas[y_top:y_top + rh, x_right:x_right + rw] = right
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--video1", required=True)
+    ap.add_argument("--video2", required=True)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--gap", type=int, default=15)
+    ap.add_argument("--bg", type=int, default=0)
+    ap.add_argument("--fps_out", type=float, default=None)
+    ap.add_argument("--end_mode", choices=["min", "hold"], default="min")
+    add_writer_args(ap)
+    args = ap.parse_args()
+
+    source1 = VideoSource(args.video1, "video1")
+    source2 = VideoSource(args.video2, "video2")
+    fps_out = args.fps_out if args.fps_out is not None else max(source1.fps, source2.fps)
 
-        writer.write(canvas)
-        out_idx += 1
+    writer = open_video_writer(args.out, fps_out, (OUT_W, OUT_H), backend=args.backend, codec=args.codec,
+                               **writer_options(args))
+    compose(source1, source2, writer, gap=args.gap, bg=args.bg, fps_out=fps_out, end_mode=args.end_mode)
 
-    cap1.release()
-    cap2.release()
+    source1.release()
+    source2.release()
     writer.release()
 
 
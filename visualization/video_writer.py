@@ -0,0 +1,132 @@
+import queue
+import shutil
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+
+WRITER_BACKENDS = ("cv2", "ffmpeg")
+
+# output arguments of the ffmpeg encoders, frames are piped in as raw bgr24
+FFMPEG_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-pix_fmt", "yuv420p"],
+    "ffv1": ["-c:v", "ffv1", "-level", "3", "-pix_fmt", "bgr0"],
+}
+
+# output containers that can hold the stream of an encoder, mp4 does not support ffv1
+FFMPEG_CONTAINERS = {
+    "ffv1": (".mkv", ".avi"),
+}
+
+
+class FFmpegWriter:
+    """
+    Video writer that pipes raw frames to an ffmpeg subprocess, same interface as cv2.VideoWriter.
+
+    - write() copies the frame into a bounded queue and returns, a background thread feeds the queue to ffmpeg,
+      so rendering and encoding run concurrently (ffmpeg itself encodes with threads threads, 0 = automatic).
+    - encoder is a key of FFMPEG_ENCODERS, preset and crf only apply to h264. ffv1 needs a .mkv or .avi path.
+    """
+
+    def __init__(self, path: str, fps: float, size, encoder: str = "h264", preset: str = "medium", crf: int = 18,
+                 threads: int = 0, queue_size: int = 16, ffmpeg_bin: str = "ffmpeg"):
+        if encoder not in FFMPEG_ENCODERS:
+            raise ValueError("Unknown encoder {}, choose from {}".format(encoder, tuple(FFMPEG_ENCODERS)))
+        containers = FFMPEG_CONTAINERS.get(encoder)
+        if containers is not None and not path.lower().endswith(containers):
+            raise ValueError("The {} encoder can not write {}, use one of {}".format(encoder, path, containers))
+        if shutil.which(ffmpeg_bin) is None:
+            raise RuntimeError("{} not found, install ffmpeg or use the cv2 writer backend".format(ffmpeg_bin))
+
+        self.path = path
+        self.w, self.h = int(size[0]), int(size[1])
+
+        cmd = [ffmpeg_bin, "-v", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{}x{}".format(self.w, self.h), "-r", str(fps),
+               "-i", "-"]
+        cmd += FFMPEG_ENCODERS[encoder]
+        if encoder == "h264":
+            cmd += ["-preset", preset, "-crf", str(crf)]
+        cmd += ["-threads", str(threads), path]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def isOpened(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def write(self, frame):
+        self._raise_thread_error()
+        if frame.shape != (self.h, self.w, 3):
+            raise ValueError("Expected a {}x{} bgr frame, got shape {}".format(self.w, self.h, frame.shape))
+        # renderers reuse their frame buffers
+        self._queue.put(np.array(frame, dtype=np.uint8, order="C"))
+
+    def release(self):
+        if self._proc is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg exited early, reported through its exit code below
+            pass
+        returncode = self._proc.wait()
+        self._proc = None
+        self._raise_thread_error()
+        if returncode != 0:
+            raise RuntimeError("ffmpeg failed with exit code {} writing {}".format(returncode, self.path))
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._proc.stdin.write(frame.data)
+            except Exception as e:
+                self._error = e
+
+    def _raise_thread_error(self):
+        if self._error is not None:
+            raise RuntimeError("Piping frames to ffmpeg for {} failed".format(self.path)) from self._error
+
+
+def open_video_writer(path: str, fps: float, size, backend: str = "cv2", codec: str = "mp4v", **ffmpeg_options):
+    """cv2.VideoWriter with the fourcc codec, or an FFmpegWriter with ffmpeg_options (encoder, preset, crf, threads)."""
+    if backend == "ffmpeg":
+        writer = FFmpegWriter(path, fps, size, **ffmpeg_options)
+    elif backend == "cv2":
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (int(size[0]), int(size[1])))
+    else:
+        raise ValueError("Unknown writer backend {}, choose from {}".format(backend, WRITER_BACKENDS))
+
+    if not writer.isOpened():
+        raise RuntimeError("Could not open VideoWriter: {}".format(path))
+    return writer
+
+
+def add_writer_args(ap):
+    ap.add_argument("--backend", choices=WRITER_BACKENDS, default="cv2",
+                    help="cv2: cv2.VideoWriter with --codec, ffmpeg: pipe frames to an ffmpeg process encoding with --encoder")
+    ap.add_argument("--codec", default="mp4v", help="fourcc of the cv2 backend")
+    ap.add_argument("--encoder", choices=tuple(FFMPEG_ENCODERS), default="h264",
+                    help="ffmpeg encoder (lossless: ffv1, which needs a .mkv or .avi output)")
+    ap.add_argument("--preset", default="medium", help="x264 preset of the h264 encoder")
+    ap.add_argument("--crf", type=int, default=18, help="x264 quality of the h264 encoder, lower is better")
+    ap.add_argument("--encoder_threads", type=int, default=0, help="ffmpeg encoder threads, 0 = automatic")
+
+
+def writer_options(args):
+    # ffmpeg_options of open_video_writer from the add_writer_args arguments
+    if args.backend != "ffmpeg":
+        return {}
+    return dict(encoder=args.encoder, preset=args.preset, crf=args.crf, threads=args.encoder_threads)
@@ -11,23 +11,36 @@ def render(x, y, t, p, shape):
     img[y, x, p] = 255
     return img
 
+
+def iter_event_frames(input_dir):
+    # one events.npy per sequence (esim_torch EventWriter) or one .npz per frame
+    store = os.path.join(input_dir, "events.npy")
+    if os.path.isfile(store):
+        events = np.load(store, mmap_mode="r")
+        offsets = np.load(os.path.join(input_dir, "frame_offsets.npy"))
+        for i0, i1 in zip(offsets[:-1], offsets[1:]):
+            frame = events[i0:i1]
+            yield {k: frame[k] for k in frame.dtype.names}
+    else:
+        for f in sorted(glob.glob(os.path.join(input_dir, "*.npz"))):
+            yield np.load(f)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("""Generate events from a high frequency video stream""")
     parser.add_argument("--input_dir", default="")
     parser.add_argument("--shape", nargs=2, type=int, default=[256, 320])
     args = parser.parse_args()
 
-    event_files = sorted(glob.glob(os.path.join(args.input_dir, "*.npz")))
+    event_frames = iter_event_frames(args.input_dir)
     
     fig, ax = plt.subplots()
-    events = np.load(event_files[0])
+    events = next(event_frames)
     img = render(shape=args.shape, **events)
     handle = plt.imshow(img)
     plt.show(block=False)
     plt.pause(0.002)
 
-    for f in event_files[1:]:
-        events = np.load(f)
+    for events in event_frames:
         img = render(shape=args.shape, **events)
         handle.set_data(img)
         plt.pause(0.002)